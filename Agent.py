@@ -0,0 +1,135 @@
+import os
+import queue
+import shutil
+import socket
+import subprocess
+import tempfile
+import threading
+from pathlib import Path
+from time import sleep, time
+from Connection import Connection
+import encoder
+
+# a coordinator that is not up yet, or gone, is retried for this long
+connect_timeout = 30.0
+# progress lines are batched into one message, which also renews the lease
+progress_interval = 1.0
+# the shared secret is handed to agents through the environment, not the visible command line
+TOKEN_ENV = "CHUNK_AGENT_TOKEN"
+CHUNK_FORMATS = ("mp4", "ivf")
+
+
+class Agent:
+    # encodes chunks leased by a coordinator and streams them back, one connection per worker
+
+    def __init__(self, address, workers=1, media=None, token=None):
+        self.address = address
+        self.token = token or os.environ.get(TOKEN_ENV, "")
+        self.workers = max(workers, 1)
+        # sources mounted in another place than on the coordinator
+        self.media = media
+        self.temp_location = Path(tempfile.mkdtemp(prefix="agent-"))
+        self.current = {}
+
+    def run(self):
+        threads = [threading.Thread(target=self.session, args=(i,)) for i in range(0, self.workers)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        shutil.rmtree(self.temp_location, ignore_errors=True)
+
+    def connect(self):
+        deadline = time() + connect_timeout
+        while True:
+            try:
+                return Connection(socket.create_connection(self.address))
+            except OSError:
+                if time() > deadline:
+                    return None
+                sleep(1)
+
+    def session(self, slot):
+        # a lost connection is opened again until the coordinator says it is done
+        while True:
+            connection = self.connect()
+            if connection is None:
+                return
+            messages = queue.Queue()
+            reader = threading.Thread(target=self.read, args=(connection, messages, slot))
+            reader.daemon = True
+            try:
+                connection.send({"type": "hello", "name": socket.gethostname(), "token": self.token})
+                reader.start()
+                while True:
+                    message = messages.get()
+                    if message is None:
+                        break
+                    if message["type"] == "done":
+                        return
+                    if message["type"] == "lease":
+                        self.encode(connection, message, slot)
+            except (OSError, ValueError):
+                pass
+            finally:
+                connection.close()
+
+    def read(self, connection, messages, slot):
+        try:
+            while True:
+                message = connection.receive()
+                if message is None:
+                    break
+                if message["type"] == "cancel":
+                    self.kill(slot)
+                else:
+                    messages.put(message)
+        except (OSError, ValueError):
+            pass
+        # a lease without a connection cannot be returned anymore
+        self.kill(slot)
+        messages.put(None)
+
+    def kill(self, slot):
+        process = self.current.get(slot)
+        if process is not None and process.poll() is None:
+            process.kill()
+
+    def encode(self, connection, lease, slot):
+        # the command is built here from checked settings, nothing from the lease is run as is
+        try:
+            encoder.validate(lease["settings"])
+            if lease["format"] not in CHUNK_FORMATS or not isinstance(lease["source"], str):
+                raise ValueError("bad format or source")
+        except (KeyError, ValueError) as e:
+            connection.send({"type": "result", "success": False, "error": f"refused lease: {e}"})
+            return
+        output = self.temp_location / f"{slot}.{lease['format']}"
+        source = Path(self.media) / Path(lease["source"]).name if self.media else Path(lease["source"])
+        # the file protocol keeps ffmpeg off URLs and other protocols
+        args = encoder.command(lease["settings"], f"file:{source}", str(output))
+        process = subprocess.Popen(args, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True, errors="replace")
+        self.current[slot] = process
+        lines = []
+        sent = time()
+        for line in process.stdout:
+            lines.append(line)
+            if time() - sent >= progress_interval:
+                connection.send({"type": "progress", "lines": lines})
+                lines = []
+                sent = time()
+        process.stdout.close()
+        message = process.stderr.read().strip()
+        process.stderr.close()
+        process.wait()
+        self.current.pop(slot, None)
+        try:
+            if process.returncode == 0 and os.path.exists(output):
+                connection.send_file({"type": "result", "success": True, "size": os.path.getsize(output)}, output)
+            else:
+                lines = message.splitlines()
+                connection.send({"type": "result", "success": False,
+                                 "error": f"exit code {process.returncode}" + (f": {lines[-1]}" if lines else "")})
+        finally:
+            if os.path.exists(output):
+                os.remove(output)
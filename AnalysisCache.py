@@ -0,0 +1,84 @@
+import hashlib
+import json
+import os
+import shutil
+import fingerprint
+
+
+class AnalysisCache:
+    # source analysis shared by every run of the same input, evicted least recently used first
+
+    def __init__(self, location=None, limit_mb=1024):
+        self.location = location or fingerprint.cache_dir() / "analysis"
+        self.limit = limit_mb * 1024 * 1024
+
+    @staticmethod
+    def key(*parts):
+        return hashlib.sha256("|".join(str(p) for p in parts).encode("utf-8")).hexdigest()
+
+    def get_analysis(self, key):
+        path = self.location / f"{key}.json"
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                entry = json.load(f)
+        except (OSError, json.JSONDecodeError):
+            return {}
+        self.touch(path)
+        return entry
+
+    def put_analysis(self, key, entry):
+        path = self.location / f"{key}.json"
+        try:
+            self.location.mkdir(parents=True, exist_ok=True)
+            tmp = path.with_suffix(f".{os.getpid()}.tmp")
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(entry, f)
+            os.replace(tmp, path)
+        except OSError:
+            return
+        self.evict()
+
+    def fetch_file(self, key, destination):
+        path = self.location / f"{key}.bin"
+        if not os.path.exists(path):
+            return False
+        try:
+            shutil.copyfile(path, destination)
+        except OSError:
+            return False
+        self.touch(path)
+        return True
+
+    def store_file(self, key, source):
+        path = self.location / f"{key}.bin"
+        try:
+            self.location.mkdir(parents=True, exist_ok=True)
+            tmp = path.with_suffix(f".{os.getpid()}.tmp")
+            shutil.copyfile(source, tmp)
+            os.replace(tmp, path)
+        except OSError:
+            return
+        self.evict()
+
+    @staticmethod
+    def touch(path):
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+
+    def evict(self):
+        try:
+            entries = [(e.stat().st_mtime, e.stat().st_size, e.path) for e in os.scandir(self.location)
+                       if e.is_file() and not e.name.endswith(".tmp")]
+        except OSError:
+            return
+        total = sum(size for mtime, size, path in entries)
+        for mtime, size, path in sorted(entries):
+            if total <= self.limit:
+                break
+            try:
+                os.remove(path)
+                total -= size
+            except OSError:
+                pass
@@ -0,0 +1,131 @@
+import json
+import os
+import subprocess
+import sys
+import ivf
+from TempStorage import TempStorage
+
+filename = "assembly.json"
+
+
+def concat_line(path):
+    # absolute, chunks can be spread over the temp folder and the staging folder
+    escaped = str(path.resolve()).replace("'", "'\\''")
+    return f"file '{escaped}'\n"
+
+
+class Assembler:
+    # concatenates the finished prefix of chunks into parts while later chunks still encode
+
+    def __init__(self, temp_location, batch_size=50, chunk_format="mp4", storage=None):
+        self.temp_location = temp_location
+        self.storage = storage or TempStorage(temp_location)
+        self.chunk_format = chunk_format
+        self.batch_size = batch_size
+        self.parts = []
+        self.next_index = 0
+
+    def load(self, scene_manager):
+        path = self.temp_location / filename
+        if not os.path.exists(path):
+            return
+        with open(path, "r", encoding="utf-8") as f:
+            parts = json.load(f)
+        # parts only stay valid for the same cut list
+        scenes = scene_manager.scenes
+        for part in parts:
+            if part["last"] >= len(scenes) or scenes[part["first"]].start != part["start"] \
+                    or scenes[part["last"]].end != part["end"]:
+                self.discard(parts)
+                return
+        self.parts = parts
+        self.next_index = parts[-1]["last"] + 1 if parts else 0
+
+    def discard(self, parts):
+        for part in parts:
+            if os.path.exists(self.temp_location / part["file"]):
+                os.remove(self.temp_location / part["file"])
+        os.remove(self.temp_location / filename)
+
+    def run(self, scene_manager, stop_event):
+        while not stop_event.is_set():
+            with scene_manager.lock:
+                count = self.ready_prefix(scene_manager)
+                finished = scene_manager.finished()
+                # a filling staging folder is emptied into a part before chunks spill to disk
+                if count < self.batch_size and not finished and not (count and self.storage.should_flush()):
+                    scene_manager.lock.wait(timeout=1)
+                    continue
+            if count == 0:
+                return
+            if not self.assemble(self.next_index, self.next_index + count - 1, scene_manager):
+                return
+            if finished and self.next_index >= len(scene_manager.scenes):
+                return
+
+    def ready_prefix(self, scene_manager):
+        count = 0
+        scenes = scene_manager.scenes
+        while self.next_index + count < len(scenes) and scenes[self.next_index + count].done_processing:
+            count += 1
+        return count
+
+    def assemble(self, first, last, scene_manager):
+        chunks = [scene_manager.chunk_name(index) for index in range(first, last + 1)]
+        if self.chunk_format == "ivf":
+            name = f"part-{len(self.parts)}.ivf"
+            if not self.join_ivf(chunks, name):
+                return False
+        else:
+            name = f"part-{len(self.parts)}.mkv"
+            if not self.join_mp4(chunks, name):
+                return False
+        scenes = scene_manager.scenes
+        self.parts.append({"file": name, "first": first, "last": last,
+                           "start": scenes[first].start, "end": scenes[last].end})
+        tmp = self.temp_location / f"{filename}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(self.parts, f)
+        os.replace(tmp, self.temp_location / filename)
+        # the part is on disk before its chunks go away
+        for chunk in chunks:
+            self.storage.remove(chunk)
+        self.next_index = last + 1
+        return True
+
+    def join_mp4(self, chunks, name):
+        list_path = self.temp_location / f"{name}.txt"
+        with open(list_path, "w") as f:
+            for chunk in chunks:
+                f.write(concat_line(self.storage.path(chunk)))
+        result = subprocess.run(
+            ["ffmpeg", "-y", "-f", "concat", "-safe", "0", "-loglevel", "fatal", "-i", list_path,
+             "-map", "0:v:0", "-c", "copy", self.temp_location / f"{name}.tmp.mkv"]
+        )
+        os.remove(list_path)
+        if result.returncode != 0:
+            return False
+        os.replace(self.temp_location / f"{name}.tmp.mkv", self.temp_location / name)
+        return True
+
+    def join_ivf(self, chunks, name):
+        for chunk in chunks:
+            if not ivf.check(self.storage.path(chunk)):
+                print(f"Chunk {chunk} failed the integrity check, leaving it for the final mux.", file=sys.stderr)
+                return False
+        tmp = self.temp_location / f"{name}.tmp"
+        with open(tmp, "wb") as f:
+            ivf.concat([self.storage.path(chunk) for chunk in chunks], f)
+        os.replace(tmp, self.temp_location / name)
+        return True
+
+    def files(self, scene_manager):
+        return [part["file"] for part in self.parts] + \
+            [scene_manager.chunk_name(index) for index in range(self.next_index, len(scene_manager.scenes))]
+
+    def clean_up(self):
+        for part in self.parts:
+            if os.path.exists(self.temp_location / part["file"]):
+                os.remove(self.temp_location / part["file"])
+        if os.path.exists(self.temp_location / filename):
+            os.remove(self.temp_location / filename)
@@ -0,0 +1,54 @@
+from time import time
+
+
+class Attempt:
+    __slots__ = ("scene", "number", "path", "process", "started", "position", "frame", "fps", "cancelled", "deadline",
+                 "preset", "speed", "crf")
+
+    def __init__(self, scene, number, path):
+        self.scene = scene
+        self.number = number
+        self.path = path
+        self.process = None
+        self.started = time()
+        self.position = 0.0
+        self.frame = 0
+        self.fps = 0.0
+        self.cancelled = False
+        # set while the chunk is leased to a remote agent
+        self.deadline = None
+        self.preset = None
+        # throughput relative to the reference preset, the cost model learns in reference seconds
+        self.speed = 1.0
+        # found by the target quality probes before the attempt started
+        self.crf = None
+
+    def elapsed(self):
+        return time() - self.started
+
+    def predicted_remaining(self, rate):
+        # seconds of wall time left, from this attempt's own speed once it has any, None if nothing is known
+        length = self.scene.get_length()
+        if self.position > 0:
+            return self.elapsed() / self.position * (length - self.position)
+        if rate:
+            return max(length * rate - self.elapsed(), 0.0)
+        return None
+
+    def update(self, line):
+        # one key=value line of ffmpeg -progress output
+        key, _, value = line.strip().partition("=")
+        try:
+            if key == "out_time_us":
+                self.position = int(value) / 1000000
+            elif key == "frame":
+                self.frame = int(value)
+            elif key == "fps":
+                self.fps = float(value)
+        except ValueError:
+            pass
+
+    def cancel(self):
+        self.cancelled = True
+        if self.process is not None and self.process.poll() is None:
+            self.process.kill()
\ No newline at end of file
@@ -0,0 +1,151 @@
+import threading
+import sys
+from pathlib import Path
+
+
+class BatchJob:
+
+    def __init__(self, process, scene_manager, priority, order):
+        self.process = process
+        self.scene_manager = scene_manager
+        self.priority = priority
+        self.order = order
+        self.detection_thread = None
+        self.finished = False
+
+
+class BatchProcess:
+
+    def __init__(self, jobs, prepare, workers, max_active=2):
+        # jobs are (source, destination, priority), analysed highest priority first
+        self.jobs = sorted(jobs, key=lambda j: -j[2])
+        self.prepare = prepare
+        self.workers = workers
+        self.max_active = max(max_active, 1)
+        self.lock = threading.Condition()
+        self.active = []
+        self.finished_count = 0
+        self.failed_count = 0
+        self.analysis_finished = False
+        self.mux_threads = []
+        self.stop_event = threading.Event()
+
+    def start(self):
+        analysis_thread = threading.Thread(target=self.analyse)
+        analysis_thread.daemon = True
+        worker_threads = [threading.Thread(target=self.worker, args=(i,)) for i in range(0, self.workers)]
+        ui_thread = threading.Thread(target=self.update_display)
+        try:
+            analysis_thread.start()
+            for t in worker_threads:
+                t.start()
+            ui_thread.start()
+            for t in worker_threads:
+                while t.is_alive():
+                    t.join(timeout=1)
+            for t in self.mux_threads:
+                while t.is_alive():
+                    t.join(timeout=1)
+            self.stop_event.set()
+            while ui_thread.is_alive():
+                ui_thread.join(timeout=1)
+            if self.failed_count:
+                print(f"{self.failed_count} of {len(self.jobs)} files were not encoded.", file=sys.stderr)
+                sys.exit(1)
+        except KeyboardInterrupt:
+            self.stop_event.set()
+            with self.lock:
+                for job in self.active:
+                    job.process.stop(job.scene_manager)
+                self.lock.notify_all()
+            print("Shutting down... Please consider the temp folders or restart to resume.")
+            for t in worker_threads:
+                t.join(timeout=1)
+            for job in self.active:
+                job.scene_manager.close()
+
+    def analyse(self):
+        # keeps the next file analysed and detecting while the current ones encode
+        try:
+            for order, (source, destination, priority) in enumerate(self.jobs):
+                with self.lock:
+                    while len(self.active) >= self.max_active and not self.stop_event.is_set():
+                        self.lock.wait()
+                if self.stop_event.is_set():
+                    return
+                try:
+                    process = self.prepare(source, destination)
+                except (Exception, SystemExit) as e:
+                    print(f"Skipping {source}: {e}", file=sys.stderr)
+                    with self.lock:
+                        self.finished_count += 1
+                        self.failed_count += 1
+                    continue
+                scene_manager = process.create_scene_manager(self.lock)
+                job = BatchJob(process, scene_manager, priority, order)
+                job.detection_thread = process.start_tasks(scene_manager)
+                with self.lock:
+                    self.active.append(job)
+                    self.lock.notify_all()
+                self.check_finished(job)
+        finally:
+            with self.lock:
+                self.analysis_finished = True
+                self.lock.notify_all()
+
+    def next_scene(self):
+        for job in sorted(self.active, key=lambda j: (-j.priority, j.order)):
+            scene, index = job.scene_manager.poll_scene()
+            if scene is not None:
+                return job, scene, index
+        return None, None, None
+
+    def worker(self, slot):
+        while not self.stop_event.is_set():
+            with self.lock:
+                while True:
+                    job, scene, index = self.next_scene()
+                    if scene is not None or self.stop_event.is_set():
+                        break
+                    if self.analysis_finished and not self.active:
+                        return
+                    self.lock.wait()
+            if scene is None:
+                return
+            job.process.encode(job.scene_manager, scene, index, slot)
+            self.check_finished(job)
+
+    def check_finished(self, job):
+        with self.lock:
+            if job.finished or not job.scene_manager.finished():
+                return
+            job.finished = True
+            self.active.remove(job)
+            self.lock.notify_all()
+        # each file is muxed as soon as its own chunks are done
+        t = threading.Thread(target=self.mux, args=(job,))
+        t.start()
+        self.mux_threads.append(t)
+
+    def mux(self, job):
+        # the last sample of the file, it leaves the sampled jobs now
+        job.process.metrics.sample(job.scene_manager)
+        muxed = job.process.mux(job.scene_manager)
+        with self.lock:
+            self.finished_count += 1
+            if not muxed:
+                self.failed_count += 1
+
+    def update_display(self):
+        while not self.stop_event.wait(1):
+            with self.lock:
+                jobs = list(self.active)
+            for job in jobs:
+                job.process.metrics.sample(job.scene_manager)
+            with self.lock:
+                files = ", ".join(f"{Path(job.process.source).name} {job.scene_manager.done_count}/"
+                                  f"{len(job.scene_manager.scenes)}" for job in self.active)
+                line = f"Files {self.finished_count}/{len(self.jobs)} Workers {self.workers} | {files}"
+            sys.stdout.write(f"\r\033[K{line}")
+            sys.stdout.flush()
+        sys.stdout.write("\n")
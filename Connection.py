@@ -0,0 +1,56 @@
+import json
+import socket
+import threading
+
+# chunks are streamed in blocks of this size
+block_size = 1 << 20
+
+
+class Connection:
+    # newline-delimited JSON messages, a successful result is followed by the raw chunk bytes
+
+    def __init__(self, sock):
+        self.sock = sock
+        self.file = sock.makefile("rwb")
+        self.lock = threading.Lock()
+        self.closed = False
+
+    def send(self, message):
+        with self.lock:
+            self.file.write((json.dumps(message) + "\n").encode("utf-8"))
+            self.file.flush()
+
+    def receive(self):
+        line = self.file.readline()
+        if not line:
+            return None
+        return json.loads(line)
+
+    def send_file(self, message, path):
+        # header and bytes go out under one lock so no other message lands in between
+        with self.lock:
+            self.file.write((json.dumps(message) + "\n").encode("utf-8"))
+            with open(path, "rb") as f:
+                while block := f.read(block_size):
+                    self.file.write(block)
+            self.file.flush()
+
+    def receive_file(self, size, path):
+        with open(path, "wb") as f:
+            while size > 0:
+                block = self.file.read(min(size, block_size))
+                if not block:
+                    raise ConnectionError("connection closed during upload")
+                f.write(block)
+                size -= len(block)
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        # wakes up a thread blocked in receive
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self.sock.close()
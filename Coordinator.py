@@ -0,0 +1,150 @@
+import hmac
+import os
+import secrets
+import socket
+import subprocess
+import sys
+import threading
+from pathlib import Path
+from Connection import Connection
+from Agent import TOKEN_ENV
+
+# how often leases are checked for expiry
+check_interval = 1.0
+
+
+class RemoteProcess:
+    # stands in for the Popen of a leased chunk so Attempt.cancel works the same
+
+    def __init__(self, connection):
+        self.connection = connection
+
+    def poll(self):
+        return 1 if self.connection.closed else None
+
+    def kill(self):
+        try:
+            self.connection.send({"type": "cancel"})
+        except OSError:
+            pass
+        self.connection.close()
+
+
+class Coordinator:
+    # leases chunks to agents over TCP next to the local workers, silent agents lose their chunk
+
+    def __init__(self, process, scene_manager, address, lease_time=60.0, token=None):
+        self.process = process
+        # agents started here get a random token when none was set
+        self.token = token or secrets.token_urlsafe(16)
+        self.scene_manager = scene_manager
+        self.lease_time = lease_time
+        self.server = socket.create_server(address)
+        self.address = self.server.getsockname()[:2]
+        self.agents = 0
+        self.local_agents = []
+        self.stopped = threading.Event()
+
+    def start(self, local_agents=0):
+        for target in (self.accept, self.check_leases):
+            t = threading.Thread(target=target)
+            t.daemon = True
+            t.start()
+        host, port = self.address
+        if host in ("", "0.0.0.0", "::"):
+            host = "127.0.0.1"
+        for i in range(0, local_agents):
+            self.local_agents.append(subprocess.Popen(
+                [sys.executable, Path(__file__).with_name("main.py"), "--agent", f"{host}:{port}"],
+                stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, env=dict(os.environ, **{TOKEN_ENV: self.token})
+            ))
+
+    def stop(self):
+        self.stopped.set()
+        self.server.close()
+        for agent in self.local_agents:
+            try:
+                agent.wait(timeout=5)
+            except subprocess.TimeoutExpired:
+                agent.kill()
+                agent.wait()
+
+    def accept(self):
+        while not self.stopped.is_set():
+            try:
+                sock, peer = self.server.accept()
+            except OSError:
+                return
+            t = threading.Thread(target=self.serve, args=(Connection(sock),))
+            t.daemon = True
+            t.start()
+
+    def serve(self, connection):
+        try:
+            hello = connection.receive()
+            if hello is None or hello.get("type") != "hello" or \
+                    not hmac.compare_digest(str(hello.get("token", "")).encode(), self.token.encode()):
+                return
+            with self.scene_manager.lock:
+                self.agents += 1
+            try:
+                while not self.stopped.is_set():
+                    scene, index = self.process.next_scene(self.scene_manager)
+                    if scene is None:
+                        connection.send({"type": "done"})
+                        return
+                    if not self.lease(connection, scene):
+                        return
+            finally:
+                with self.scene_manager.lock:
+                    self.agents -= 1
+        except (OSError, ValueError):
+            pass
+        finally:
+            connection.close()
+
+    def lease(self, connection, scene):
+        # False once the connection is gone, the chunk is then back in the queue
+        scene_manager = self.scene_manager
+        attempt = self.process.start_attempt(scene_manager, scene)
+        if attempt is None:
+            return True
+        # built before the lease clock starts, like the CRF in start_attempt
+        settings = self.process.encode_settings(scene, attempt.preset, attempt.crf)
+        attempt.process = RemoteProcess(connection)
+        scene_manager.renew(attempt, self.lease_time)
+        success = False
+        requeue = True
+        error = None
+        try:
+            connection.send({"type": "lease", "index": scene.index, "format": self.process.chunk_format,
+                             "source": self.process.source,
+                             "settings": settings})
+            while True:
+                message = connection.receive()
+                if message is None:
+                    break
+                # every message from the agent renews its lease
+                scene_manager.renew(attempt, self.lease_time)
+                if message["type"] == "progress":
+                    for line in message["lines"]:
+                        attempt.update(line)
+                elif message["type"] == "result":
+                    if message["success"]:
+                        connection.receive_file(message["size"], attempt.path)
+                        success = self.process.chunk_ok(0, attempt.path)
+                    if not success:
+                        error = "incomplete chunk" if message["success"] else message.get("error", "agent failed")
+                    requeue = False
+                    break
+        except (OSError, ValueError, KeyError):
+            pass
+        won = scene_manager.attempt_finished(attempt, success, requeue, error)
+        self.process.metrics.chunk_finished(attempt, won, error)
+        return not requeue
+
+    def check_leases(self):
+        while not self.stopped.wait(check_interval):
+            for attempt in self.scene_manager.expired_leases():
+                # the serving thread sees the closed connection and requeues the chunk
+                attempt.process.kill()
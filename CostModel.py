@@ -0,0 +1,63 @@
+class CostModel:
+    # encode seconds per frame per megapixel, fitted linearly against the mean scene score
+
+    def __init__(self, source_fps, resolution):
+        self.source_fps = source_fps
+        self.megapixels = resolution[0] * resolution[1] / 1000000
+        self.count = 0
+        self.sum_x = 0.0
+        self.sum_y = 0.0
+        self.sum_xx = 0.0
+        self.sum_xy = 0.0
+        self.a = None
+        self.b = 0.0
+
+    def trained(self):
+        return self.a is not None
+
+    def mean_complexity(self):
+        return self.sum_x / self.count if self.count else 0.0
+
+    def observe(self, length, complexity, seconds):
+        frames = length * self.source_fps
+        if frames <= 0 or seconds <= 0:
+            return
+        x = complexity or 0.0
+        y = seconds / (frames * self.megapixels)
+        self.count += 1
+        self.sum_x += x
+        self.sum_y += y
+        self.sum_xx += x * x
+        self.sum_xy += x * y
+        mean_x = self.sum_x / self.count
+        mean_y = self.sum_y / self.count
+        variance = self.sum_xx / self.count - mean_x * mean_x
+        if self.count >= 3 and variance > 1e-9:
+            self.b = max((self.sum_xy / self.count - mean_x * mean_y) / variance, 0.0)
+        else:
+            self.b = 0.0
+        self.a = mean_y - self.b * mean_x
+
+    def shape(self):
+        # the longest-first order only depends on how much complexity adds per unit of base cost
+        if not self.trained() or self.a <= 0:
+            return None
+        return self.b / self.a
+
+    def rate(self, complexity):
+        # encode seconds per second of video
+        if complexity is None:
+            complexity = self.mean_complexity()
+        return self.source_fps * self.megapixels * max(self.a + self.b * complexity, 1e-6)
+
+    def predict(self, length, complexity):
+        if not self.trained():
+            # untrained, duration alone keeps the longest-first order
+            return length
+        return length * self.rate(complexity)
+
+    def predict_sum(self, length, complexity_length):
+        # total cost from the running sums of length and length * complexity
+        if not self.trained():
+            return None
+        return self.source_fps * self.megapixels * max(self.a * length + self.b * complexity_length, 0.0)
\ No newline at end of file
@@ -7,12 +7,55 @@ from pathlib import Path
 from Scene import *
 import time
 import os
+import math
 from concurrent.futures import ThreadPoolExecutor
 from SceneManager import SceneManager
+from FrameServer import FrameServer
+from SceneIndex import SceneIndex, CutFinder
+from FrameIndex import FrameIndex
+from array import array
+from AnalysisCache import AnalysisCache
+from Metrics import Metrics
+from Assembler import Assembler, concat_line
+from TempStorage import TempStorage, MIN_FREE_MB
+from CostModel import CostModel
+from Coordinator import Coordinator
+from TargetQuality import TargetQuality
+from PresetScheduler import PresetScheduler
+import video
+import cpu
+import ivf
+import mp4
+import encoder
+
+SEGMENT_OVERLAP = 1.0
+AUDIO_FILE = "audio.mka"
+# how the job cuts its chunks, by frame numbers or timestamps, kept across restarts
+CUTTING_FILE = "cutting.txt"
+# the first chunk waits this long for the frame index before the job is cut by timestamps
+FRAME_INDEX_WAIT = 900.0
+# automatic chunk limit: enough chunks per worker that the last ones are short
+CHUNKS_PER_WORKER = 8
+MIN_AUTO_CHUNK = 10.0
+# scene cuts move onto a keyframe this many frames away, so the chunk decodes nothing it throws away
+KEYFRAME_SNAP = 2
+
+def mean_score(frames):
+    if not frames:
+        return None
+    return sum(score for timestamp, score in frames) / len(frames)
+
 
 class EncodingProcess:
 
-    def __init__(self, source, destination, temp_location, workers, crop, resolution, start_time, length, source_fps, hdr):
+    def __init__(self, source, destination, temp_location, workers, crop, resolution, start_time, length, source_fps, hdr,
+                 frame_server=False, buffer_mb=1024, scd_segments=1, scd_width=None, scd_step=1,
+                 scd_threshold=0.25, min_scene=1.0, max_scene=None, analysis_cache=None, source_key=None,
+                 max_chunk=None, split_mode="even", speculate=False,
+                 metrics_path=None, layout=None, chunk_format="mp4", listen=None, lease_time=60.0,
+                 local_agents=0, preset=4, target_quality=None, target_metric="vmaf", probes=4,
+                 probe_width=480, probe_step=1, deadline=None, min_preset=2, max_preset=12, staging=None,
+                 staging_mb=2048, min_free_mb=MIN_FREE_MB, token=None):
         self.source = source
         self.destination = destination
         self.temp_location = Path(temp_location)
@@ -23,22 +66,139 @@ class EncodingProcess:
         self.source_fps = source_fps
         self.hdr = hdr
         self.max_workers = workers
+        self.layout = layout or cpu.plan(resolution, workers)
         self.stop_event = threading.Event()
+        self.frame_server = frame_server
+        self.buffer_mb = buffer_mb
+        self.scd_segments = max(scd_segments, 1)
+        self.scd_width = scd_width
+        self.scd_step = max(scd_step, 1)
+        self.scd_threshold = scd_threshold
+        self.min_scene = min_scene
+        self.max_scene = max_scene
+        if max_chunk is None:
+            max_chunk = max((length - start_time) / (workers * CHUNKS_PER_WORKER), MIN_AUTO_CHUNK)
+        self.max_chunk = max_chunk
+        self.split_mode = split_mode
+        self.speculate = speculate
+        self.metrics = Metrics(metrics_path, workers, source)
+        self.cost_model = CostModel(source_fps, resolution)
+        self.chunk_format = chunk_format
+        self.storage = TempStorage(self.temp_location, staging, staging_mb, min_free_mb)
+        self.assembler = Assembler(self.temp_location, chunk_format=chunk_format, storage=self.storage)
+        self.preset = preset
+        self.scheduler = PresetScheduler(deadline, preset, min_preset, max_preset) if deadline else None
+        self.target_quality = None
+        if target_quality is not None:
+            self.target_quality = TargetQuality(source, self.temp_location, crop, resolution, target_quality,
+                                                target_metric, probes, probe_width, probe_step, self.layout,
+                                                self.stop_event)
+        self.listen = listen
+        self.lease_time = lease_time
+        self.local_agents = local_agents
+        self.token = token
+        self.coordinator = None
+        self.frame_index = None
+        self.frame_index_ready = threading.Event()
+        self.frame_index_lock = threading.Lock()
+        self.cutting = None
+        self.cutting_lock = threading.Lock()
+        self.audio_thread = None
+        self.assembler_thread = None
+        self.analysis_cache = analysis_cache
+        # the stored scores only cover the source from the content start on
+        self.scores_key = AnalysisCache.key(source_key, self.crop, self.scd_width, self.scd_step,
+                                            self.content_start_time)
+        self.frames_key = AnalysisCache.key(source_key, "frames")
         # variables
         self.passed_time = "--:--:--"
 
-    def start(self):
-        scene_manager = SceneManager(self.temp_location, self.content_start_time)
-        worker_threads = []
+    def create_scene_manager(self, lock=None):
+        return SceneManager(self.temp_location, self.content_start_time, self.min_scene,
+                            {"threshold": self.scd_threshold, "min": self.min_scene, "max": self.max_scene},
+                            self.cost_model, lock, self.chunk_format, self.storage)
+
+    def start_tasks(self, scene_manager):
+        # detection, audio and assembly run alongside the encoders from the start
+        frame_index_thread = threading.Thread(target=self.build_frame_index)
+        frame_index_thread.daemon = True
+        frame_index_thread.start()
         scene_detection_thread = threading.Thread(target=self.scene_detection, args=(scene_manager,))
         scene_detection_thread.daemon = True
+        if not scene_manager.scd_finished:
+            scene_detection_thread.start()
+        self.audio_thread = threading.Thread(target=self.encode_audio)
+        self.audio_thread.daemon = True
+        self.audio_thread.start()
+        self.assembler.load(scene_manager)
+        scene_manager.requeue_missing(self.assembler.next_index)
+        self.assembler_thread = threading.Thread(target=self.assembler.run, args=(scene_manager, self.stop_event,))
+        self.assembler_thread.daemon = True
+        self.assembler_thread.start()
+        return scene_detection_thread
+
+    def build_frame_index(self):
+        # started early in the background, the first chunk that needs it otherwise builds it
+        with self.frame_index_lock:
+            if not self.frame_index_ready.is_set():
+                self.load_frame_index()
+        return self.frame_index
+
+    def load_frame_index(self):
+        try:
+            index = FrameIndex(self.temp_location)
+            # the packet scan of a big source takes minutes, every later run of the same source reuses it
+            if not index.exists() and self.analysis_cache:
+                self.analysis_cache.fetch_file(self.frames_key, index.path)
+            if index.load():
+                self.frame_index = index
+            elif index.build(self.source, video.probe(self.source).start_time):
+                self.frame_index = index
+                if self.analysis_cache:
+                    self.analysis_cache.store_file(self.frames_key, index.path)
+        except (subprocess.CalledProcessError, OSError, ValueError):
+            pass
+        finally:
+            # without an index chunks are cut by timestamp
+            self.frame_index_ready.set()
+
+    def encode_audio(self):
+        audio_path = self.temp_location / AUDIO_FILE
+        if os.path.exists(audio_path):
+            return
+        tmp = self.temp_location / ("tmp-" + AUDIO_FILE)
+        result = subprocess.run(
+            ["ffmpeg", "-y", "-ss", str(self.content_start_time), "-i", self.source, "-nostdin",
+             "-loglevel", "fatal", "-map", "0:a:0", "-vn", "-c:a", "libopus", "-b:a", "96k", tmp],
+            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+        )
+        if result.returncode == 0:
+            os.replace(tmp, audio_path)
+        elif os.path.exists(tmp):
+            os.remove(tmp)
+
+    def start(self):
+        scene_manager = self.create_scene_manager()
+        worker_threads = []
         ui_thread = threading.Thread(target=self.update_display, args=(worker_threads, scene_manager,))
         try:
-            if not scene_manager.scd_finished:
-                scene_detection_thread.start()
+            scene_detection_thread = self.start_tasks(scene_manager)
+            if self.listen:
+                self.coordinator = Coordinator(self, scene_manager, self.listen, self.lease_time, self.token)
+                self.coordinator.start(self.local_agents)
 
+            if self.frame_server:
+                server = FrameServer(self.source, self.temp_location, self.crop, self.resolution,
+                                     self.source_fps, self.stop_event, self.buffer_mb,
+                                     self.encoder_params(), self.layout, self.chunk_format, self.chunk_params)
+                server_thread = threading.Thread(target=server.run, args=(scene_manager, self.max_workers, self.length))
+                server_thread.daemon = True
+                server_thread.start()
+                worker_target = server.encoder
+            else:
+                worker_target = self.worker
             for i in range(0, self.max_workers):
-                t = threading.Thread(target=self.worker, args=(scene_manager,))
+                t = threading.Thread(target=worker_target, args=(scene_manager, i,))
                 t.start()
                 worker_threads.append(t)
 
@@ -49,84 +209,357 @@ class EncodingProcess:
             for t in worker_threads:
                 while t.is_alive():
                     t.join(timeout=1)
-            self.mux(scene_manager)
+            if self.coordinator is not None:
+                self.coordinator.stop()
+            muxed = self.mux(scene_manager)
             while ui_thread.is_alive():
                 ui_thread.join(timeout=1)
+            if not muxed:
+                sys.exit(1)
         except KeyboardInterrupt:
-            self.stop_event.set()
+            self.stop(scene_manager)
             while ui_thread.is_alive():
                 ui_thread.join(timeout=1)
             print("Shutting down... Please consider the temp folder or restart to resume.")
+            if self.coordinator is not None:
+                self.coordinator.stop()
             for t in worker_threads:
                 t.join(timeout=1)
+            scene_manager.close()
+
+    def stop(self, scene_manager):
+        # no chunk or probe starts after this, the running ones are killed
+        self.stop_event.set()
+        scene_manager.stop()
+        if self.target_quality is not None:
+            self.target_quality.stop()
 
     def scene_detection(self, scene_manager):
+        # a resumed detection continues from the last journaled cut
+        resume_time = scene_manager.scenes[-1].start
+        finder = CutFinder(resume_time, self.scd_threshold, self.min_scene, self.max_scene)
+        index = SceneIndex(self.temp_location, self.scd_width, self.scd_step)
+        # (timestamp, score) of every frame in the open scene
+        pending = []
+        self.metrics.detection_started()
+
+        def emit(timestamp, score):
+            if timestamp >= resume_time:
+                pending.append((timestamp, score))
+            for cut in finder.feed(timestamp, score):
+                self.add_cut(scene_manager, cut, pending)
+
+        try:
+            if not index.exists() and self.analysis_cache:
+                self.analysis_cache.fetch_file(self.scores_key, index.path)
+            if index.exists():
+                for timestamp, score in index.frames(self.length):
+                    emit(timestamp, score)
+                return
+
+            if self.scd_segments > 1:
+                segments = video.get_segments(self.source, resume_time, self.length, self.scd_segments)
+            else:
+                segments = [(resume_time, self.length)]
+            # only a detection over the whole source can be stored as the index
+            values = array("d") if resume_time == self.content_start_time else None
+            with ThreadPoolExecutor(max_workers=len(segments)) as executor:
+                futures = [executor.submit(self.detect_segment, start, end, emit if i == 0 else None)
+                           for i, (start, end) in enumerate(segments)]
+                # the first segment streams its cuts, the rest are merged in order
+                for i, future in enumerate(futures):
+                    scores = future.result()
+                    if scores is None:
+                        values = None
+                    if i > 0 and scores:
+                        for j in range(0, len(scores), 2):
+                            emit(scores[j], scores[j + 1])
+                    if values is not None:
+                        values.extend(scores)
+            if values is not None and not self.stop_event.is_set():
+                index.save(values)
+                if self.analysis_cache:
+                    self.analysis_cache.store_file(self.scores_key, index.path)
+        finally:
+            for point in self.split_points(scene_manager.scenes[-1].start, self.length):
+                self.close_scene(scene_manager, point, pending)
+            scene_manager.finish_last_scene(self.length, mean_score(pending))
+            self.metrics.detection_finished()
+
+    def add_cut(self, scene_manager, timestamp, pending):
+        timestamp = self.snap_cut(timestamp)
+        for point in self.split_points(scene_manager.scenes[-1].start, timestamp):
+            self.close_scene(scene_manager, point, pending)
+        self.close_scene(scene_manager, timestamp, pending)
+
+    @staticmethod
+    def close_scene(scene_manager, timestamp, pending):
+        scene_frames = [frame for frame in pending if frame[0] < timestamp]
+        if scene_manager.add_scene(timestamp, mean_score(scene_frames)):
+            del pending[:len(scene_frames)]
+
+    def snap_cut(self, timestamp):
+        if not self.frame_index_ready.is_set() or self.frame_index is None:
+            return timestamp
+        keyframe = self.frame_index.keyframe_near(self.frame_index.frame_at(timestamp), KEYFRAME_SNAP)
+        return self.frame_index.pts[keyframe] if keyframe is not None else timestamp
+
+    def keyframe_after(self, timestamp):
+        if self.frame_index_ready.is_set() and self.frame_index is not None:
+            keyframe = self.frame_index.keyframe_after(self.frame_index.frame_at(timestamp))
+            return self.frame_index.pts[keyframe] if keyframe is not None else None
+        return video.get_keyframe_after(self.source, timestamp)
+
+    def split_points(self, start, end):
+        if not self.max_chunk or end - start <= self.max_chunk:
+            return []
+        parts = math.ceil((end - start) / self.max_chunk)
+        step = (end - start) / parts
+        points = []
+        for i in range(1, parts):
+            point = start + i * step
+            if self.split_mode == "keyframe":
+                keyframe = self.keyframe_after(point)
+                # fall back to the even split when the next keyframe is far away
+                if keyframe is not None and keyframe - point < step / 2 and keyframe < end - self.min_scene:
+                    point = keyframe
+            points.append(point)
+        return points
+
+    def detect_segment(self, start, end, emit=None):
+        filters = []
         if self.crop:
-            filter_str = self.crop + ",select='gt(scene,0.25)',showinfo"
-        else:
-            filter_str = "select='gt(scene,0.25)',showinfo"
+            filters.append(self.crop)
+        if self.scd_step > 1:
+            filters.append(f"framestep={self.scd_step}")
+        if self.scd_width:
+            filters.append(f"scale={self.scd_width}:-2")
+        filters.append("select='gte(scene,0)',metadata=print:key=lavfi.scene_score")
+        # segments after the first start decoding early so a cut on the boundary is still seen
+        seek = max(start - SEGMENT_OVERLAP, 0.0) if start > self.content_start_time else 0.0
+        cmd = ["ffmpeg"]
+        if seek > 0:
+            cmd += ["-ss", str(seek)]
+        cmd += ["-i", self.source, "-nostdin", "-map", "0:v:0"]
+        if end < self.length:
+            cmd += ["-t", str(end - seek)]
+        cmd += ["-filter:v", ",".join(filters), "-f", "null", "-"]
         scene_detection_process = subprocess.Popen(
-            [
-                "ffmpeg", "-i", self.source, "-nostdin",
-                "-filter:v", filter_str,
-                "-f", "null", "-"
-            ],
+            cmd,
             stderr=subprocess.PIPE,
-            stdout=subprocess.DEVNULL,  # We only care about stderr for showinfo
+            stdout=subprocess.DEVNULL,  # We only care about stderr for the metadata
             text=True,
             errors="replace"
         )
+        scores = array("d")
+        timestamp = None
         try:
             for line in iter(scene_detection_process.stderr.readline, ""):
-                if '] n:' in line:
-                    match = re.search(r"pts_time:(\d+\.\d+)", line)
-                    if match:
-                        timestamp = float(match.group(1))
-                        if timestamp > self.content_start_time:
-                            scene_manager.add_scene(timestamp)
+                match = re.search(r"pts_time:(\d+(?:\.\d+)?)", line)
+                if match:
+                    timestamp = float(match.group(1)) + seek
+                    continue
+                match = re.search(r"lavfi\.scene_score=(\d+(?:\.\d+)?)", line)
+                if match and timestamp is not None:
+                    if start <= timestamp < end:
+                        score = float(match.group(1))
+                        scores.append(timestamp)
+                        scores.append(score)
+                        if emit:
+                            emit(timestamp, score)
+                    timestamp = None
         finally:
             scene_detection_process.stderr.close()
             scene_detection_process.wait()
-            scene_manager.finish_last_scene(self.length)
+        if scene_detection_process.returncode != 0:
+            return None
+        return scores
 
-    def worker(self, scene_manager):
+    def encoder_params(self, preset=None):
+        return encoder.params(self.preset if preset is None else preset, self.layout.threads)
+
+    def next_scene(self, scene_manager):
         while not self.stop_event.is_set():
             scene, index = scene_manager.request_scene()
+            if scene is None and self.speculate:
+                scene, index = scene_manager.request_straggler()
+            if scene is not None:
+                return scene, index
+            # with agents connected a lease can still expire and put its chunk back
+            if self.coordinator is None or not scene_manager.wait_for_requeue(1):
+                break
+        return None, None
+
+    def worker(self, scene_manager, slot=0):
+        while not self.stop_event.is_set():
+            scene, index = self.next_scene(scene_manager)
             if scene is None:
                 break
-            x, y = self.resolution
-            if self.crop:
-                filter_complex = "[0:v:0]" + self.crop + ",scale=" + str(x) + ":" + str(y) + "[v]"
-            else:
-                filter_complex = "[0:v:0]scale=" + str(x) + ":" + str(y) + "[v]"
-            result = subprocess.run(
-                ["ffmpeg", "-y", "-ss", str(scene.start), "-to", str(scene.end), "-i", self.source, "-nostdin",
-                 "-loglevel", "fatal",
-                 "-filter_complex", filter_complex, "-an", "-map", "[v]",
-                 "-c:v", "libsvtav1", "-preset", "4", "-pix_fmt", "yuv420p10le",
-                 f"{self.temp_location / str(index)}.mp4"], capture_output=True
+            self.encode(scene_manager, scene, index, slot)
+
+    def chunk_crf(self, scene, slot=None):
+        # without any usable probe the chunk keeps the encoder default
+        if self.target_quality is None:
+            return None
+        return self.target_quality.find_crf(scene, slot)
+
+    def chunk_params(self, scene, slot=None):
+        crf = self.chunk_crf(scene, slot)
+        return ["-crf", str(crf)] if crf is not None else []
+
+    def start_attempt(self, scene_manager, scene, slot=None):
+        # probes and the preset come before the chunk counts as running, its clock only times the encode
+        crf = self.chunk_crf(scene, slot)
+        preset = self.preset
+        if self.scheduler is not None:
+            workers = self.max_workers + (self.coordinator.agents if self.coordinator is not None else 0)
+            preset = self.scheduler.choose(scene_manager, self.length, workers)
+        if not self.storage.wait_for_space(scene.get_length(), self.stop_event, scene_manager.running):
+            if not self.stop_event.is_set():
+                scene_manager.give_up(scene, "not enough space left in the temp folder")
+            return None
+        attempt = scene_manager.start_attempt(scene)
+        if attempt is None:
+            return None
+        attempt.preset = preset
+        attempt.crf = crf
+        if self.scheduler is not None:
+            attempt.speed = self.scheduler.speed(preset)
+        return attempt
+
+    def cut_by_frames(self):
+        # decided on the first chunk and kept across restarts, so neighbouring chunks never mix both ways
+        with self.cutting_lock:
+            if self.cutting is None:
+                path = self.temp_location / CUTTING_FILE
+                if os.path.exists(path):
+                    with open(path, "r", encoding="utf-8") as f:
+                        self.cutting = f.read().strip()
+                else:
+                    deadline = time.time() + FRAME_INDEX_WAIT
+                    while not self.frame_index_ready.wait(1) and time.time() < deadline:
+                        if self.stop_event.is_set():
+                            return False
+                    if not self.frame_index_ready.is_set():
+                        print(f"The frame index took longer than {FRAME_INDEX_WAIT:.0f}s, cutting by timestamps.",
+                              file=sys.stderr)
+                    ready = self.frame_index_ready.is_set() and self.frame_index is not None
+                    self.cutting = "frames" if ready else "timestamps"
+                    with open(path, "w", encoding="utf-8") as f:
+                        f.write(self.cutting)
+        # a restarted job that cut by frames loads the saved index first
+        return self.cutting == "frames" and self.build_frame_index() is not None
+
+    def encode_settings(self, scene, preset=None, crf=None):
+        # everything a chunk's command is built from, agents get the same and build it themselves
+        settings = {"start": scene.start, "end": scene.end, "trim": None, "crop": self.crop,
+                    "resolution": list(self.resolution), "threads": self.layout.threads,
+                    "preset": self.preset if preset is None else preset, "crf": crf, "frames": None}
+        if self.cut_by_frames():
+            # fast seek to the keyframe before the chunk, then trim between frame boundaries. Timestamps after -ss
+            # count from the requested seek time, so a seek landing on an earlier keyframe shifts nothing
+            index = self.frame_index
+            first = index.frame_at(scene.start)
+            last = index.frame_at(scene.end)
+            seek = index.seek_time(index.keyframe_before(first))
+            settings["start"] = seek
+            settings["trim"] = [index.boundary(first) - seek, index.boundary(last) - seek]
+            settings["frames"] = last - first
+        return settings
+
+    def encode_command(self, scene, source, output, preset=None, crf=None):
+        return encoder.command(self.encode_settings(scene, preset, crf), source, output)
+
+    def encode(self, scene_manager, scene, index, slot=0):
+        # an unexpected error fails the chunk and not the worker, the scene never stays taken
+        try:
+            attempt = self.start_attempt(scene_manager, scene, slot)
+        except Exception as e:
+            scene_manager.give_up(scene, str(e) or type(e).__name__)
+            return False
+        if attempt is None:
+            return False
+        try:
+            process = subprocess.Popen(
+                self.encode_command(scene, self.source, str(attempt.path), attempt.preset, attempt.crf),
+                stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True, errors="replace"
             )
-            if result.returncode == 0:
-                scene_manager.scene_finished(scene)
+            self.layout.pin(process, slot)
+            attempt.process = process
+            if attempt.cancelled:
+                process.kill()
+            for line in process.stdout:
+                attempt.update(line)
+            process.stdout.close()
+            # only fatal messages are logged, they fit the pipe buffer
+            message = process.stderr.read().strip()
+            process.stderr.close()
+            process.wait()
+            success = self.chunk_ok(process.returncode, attempt.path)
+            error = None if success else self.chunk_error(process.returncode, message)
+        except Exception as e:
+            # killed but not cancelled, the chunk still goes through the retries
+            if attempt.process is not None and attempt.process.poll() is None:
+                attempt.process.kill()
+                attempt.process.wait()
+            success = False
+            error = str(e) or type(e).__name__
+        won = scene_manager.attempt_finished(attempt, success, error=error)
+        self.metrics.chunk_finished(attempt, won, error)
+        return won
+
+    def chunk_ok(self, returncode, path):
+        # a raw chunk is checked frame by frame, an mp4 by its top level boxes
+        if returncode != 0:
+            return False
+        return ivf.check(path) if self.chunk_format == "ivf" else mp4.check(path)
+
+    @staticmethod
+    def chunk_error(returncode, message):
+        if returncode == 0:
+            return "incomplete chunk"
+        lines = message.splitlines()
+        return f"exit code {returncode}" + (f": {lines[-1]}" if lines else "")
+
+    def report_failures(self, scene_manager):
+        for index in sorted(scene_manager.failed):
+            scene = scene_manager.scenes[index]
+            errors = scene_manager.failures.get(index, [])
+            print(f"Chunk {index} ({scene.start:.3f}s-{scene.end:.3f}s) failed {len(errors)} times, "
+                  f"last: {errors[-1] if errors and errors[-1] else 'unknown error'}", file=sys.stderr)
+        print(f"Not muxing {self.destination}, restart to retry the failed chunks from the temp folder "
+              f"{self.temp_location}.", file=sys.stderr)
 
     def update_display(self, worker_threads, scene_manager):
         sys.stdout.write("\033\n")
         sys.stdout.write("\033\n")
         while not self.stop_event.wait(1):
-            scenes = scene_manager.scenes
-            all_scenes_done_processing = not any(not scene.done_processing for scene in scenes)
+            scene_count = len(scene_manager.scenes)
+            done_count = scene_manager.done_count
+            all_scenes_done_processing = scene_manager.finished()
             alive_threads = sum(1 for t in worker_threads if t.is_alive())
-            total_processed_length = sum(s.get_length() for s in scenes if s.done_processing)
+            snapshot = self.metrics.sample(scene_manager)
+            total_processed_length = snapshot["done_length"] + snapshot["in_flight_length"]
             progress = min(total_processed_length / self.length, 1.0)
-            if scene_manager.most_recent_timestamp:
+            # live encoder speed of the running chunks, completed work only as a fallback
+            if snapshot["encoder_fps"] > 0:
+                fps = snapshot["encoder_fps"]
+            elif scene_manager.most_recent_timestamp:
                 fps = (scene_manager.finished_length / (scene_manager.most_recent_timestamp - scene_manager.start_timestamp)) * self.source_fps
-                eta = time.strftime('%H:%M:%S', time.gmtime(round((((self.length - total_processed_length) * self.source_fps) / fps), 0)))
             else:
                 fps = 0
+            predicted = scene_manager.predicted_remaining(self.length)
+            if predicted is not None:
+                eta = time.strftime('%H:%M:%S', time.gmtime(round(predicted / self.max_workers, 0)))
+            elif fps > 0:
+                eta = time.strftime('%H:%M:%S', time.gmtime(round((((self.length - total_processed_length) * self.source_fps) / fps), 0)))
+            else:
                 eta = "--:--:--"
             self.passed_time = time.strftime('%H:%M:%S', time.gmtime(time.time() - scene_manager.start_timestamp))
             sys.stdout.write("\033[F" * 2)
-            sys.stdout.write(f"\033[KScenes {sum(1 for s in scenes if s.done_processing)}/{len(scenes)} Workers {alive_threads} ")
+            agents = f" + {self.coordinator.agents} remote" if self.coordinator is not None else ""
+            sys.stdout.write(f"\033[KScenes {done_count}/{scene_count} Workers {alive_threads}{agents} "
+                             f"({self.layout.describe()}) ")
             sys.stdout.write(f"\033[K{self.resolution[0]}x{self.resolution[1]} {'HDR' if self.hdr else 'SDR'}\n")
             bar_width = 60
             filled = int(progress / 1.0 * bar_width)
@@ -139,24 +572,80 @@ class EncodingProcess:
                     break
 
     def mux(self, scene_manager):
+        if self.assembler_thread is not None:
+            self.assembler_thread.join()
+        if scene_manager.failed:
+            self.report_failures(scene_manager)
+            scene_manager.close()
+            return False
+        files = self.assembler.files(scene_manager)
         file_name = "videos.txt"
-        with open(self.temp_location / file_name, 'w') as f:
-            for index, scene in enumerate(scene_manager.scenes):
-                f.write(f"file '{index}.mp4'\n")
-
-        cmd = [
-            "ffmpeg", "-y", "-f", "concat", "-safe", "0", "-loglevel", "fatal",
-            "-i", self.temp_location / file_name, "-ss", str(self.content_start_time),
-            "-i", self.source, "-map", "0:v:0",
-            "-c:v", "copy",
-            "-map", "1:a:0", "-c:a", "libopus", "-b:a", "96k", self.destination
-        ]
-        subprocess.run(cmd)
+        if self.chunk_format == "mp4":
+            with open(self.temp_location / file_name, 'w') as f:
+                for chunk in files:
+                    f.write(concat_line(self.storage.path(chunk)))
+
+        if self.audio_thread is not None:
+            self.audio_thread.join()
+        audio_path = self.temp_location / AUDIO_FILE
+        if os.path.exists(audio_path):
+            # audio was encoded in the background, both streams are copied
+            audio = ["-i", audio_path, "-map", "0:v:0", "-map", "1:a:0", "-c", "copy"]
+        else:
+            audio = ["-ss", str(self.content_start_time), "-i", self.source, "-map", "0:v:0", "-c:v", "copy",
+                     "-map", "1:a:0", "-c:a", "libopus", "-b:a", "96k"]
+        if self.chunk_format == "ivf":
+            # parts and chunks are joined byte by byte into the muxer, no concat demuxer pass
+            process = subprocess.Popen(
+                ["ffmpeg", "-y", "-f", "ivf", "-loglevel", "fatal", "-i", "pipe:0"] + audio + [self.destination],
+                stdin=subprocess.PIPE
+            )
+            concatenated = False
+            try:
+                ivf.concat([self.storage.path(chunk) for chunk in files], process.stdin)
+                concatenated = True
+            except (OSError, ValueError) as e:
+                print(f"Concatenating the chunks failed: {e}", file=sys.stderr)
+            finally:
+                try:
+                    process.stdin.close()
+                except OSError:
+                    concatenated = False
+                process.wait()
+            muxed = concatenated and process.returncode == 0
+        else:
+            cmd = [
+                "ffmpeg", "-y", "-f", "concat", "-safe", "0", "-loglevel", "fatal",
+                "-i", self.temp_location / file_name] + audio + [self.destination]
+            muxed = subprocess.run(cmd).returncode == 0
+        if not muxed:
+            # nothing is deleted, a restart muxes again from the parts and chunks
+            print(f"Muxing {self.destination} failed, the encoded chunks are kept in {self.temp_location}.",
+                  file=sys.stderr)
+            scene_manager.close()
+            return False
         try:
             scene_manager.clean_up()
-            os.remove(self.temp_location / file_name)
+            self.assembler.clean_up()
+            if self.target_quality is not None:
+                self.target_quality.clean_up()
+            if os.path.exists(self.temp_location / file_name):
+                os.remove(self.temp_location / file_name)
             for index, scene in enumerate(scene_manager.scenes):
-                os.remove(self.temp_location / (str(index) + ".mp4"))
+                self.storage.remove(scene_manager.chunk_name(index))
+            self.storage.clean_up()
+            if os.path.exists(audio_path):
+                os.remove(audio_path)
+            for path in self.temp_location.glob(f"*.dup*.{self.chunk_format}"):
+                os.remove(path)
+            if os.path.exists(self.temp_location / CUTTING_FILE):
+                os.remove(self.temp_location / CUTTING_FILE)
+            frame_index = FrameIndex(self.temp_location)
+            if frame_index.exists():
+                os.remove(frame_index.path)
+            for path in self.temp_location.glob("scores-*.bin"):
+                os.remove(path)
             os.rmdir(self.temp_location)
         except Exception:
             sys.exit("Unexpected error deleting temporary files. Please check the temporary folder " + str(self.temp_location))
+        return True
@@ -0,0 +1,105 @@
+import bisect
+import os
+import struct
+import subprocess
+from array import array
+
+filename = "frames.bin"
+HEADER = struct.Struct("<II")
+
+
+class FrameIndex:
+    # pts of every video frame and the keyframe numbers, from one ffprobe packet scan
+
+    def __init__(self, temp_location):
+        self.path = temp_location / filename
+        self.pts = array("d")
+        self.keyframes = array("I")
+
+    def exists(self):
+        return os.path.exists(self.path)
+
+    def build(self, source, start_time=0.0):
+        process = subprocess.Popen(
+            ["ffprobe", "-v", "error", "-select_streams", "v:0", "-show_entries", "packet=pts_time,flags",
+             "-of", "csv=p=0", source],
+            stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True
+        )
+        packets = []
+        for line in process.stdout:
+            pts, _, flags = line.strip().partition(",")
+            try:
+                # relative to the container start, like ffmpeg's -ss and output timestamps
+                packets.append((float(pts) - start_time, "K" in flags))
+            except ValueError:
+                continue
+        process.stdout.close()
+        process.wait()
+        if process.returncode != 0 or not packets:
+            return False
+        # packets arrive in decode order
+        packets.sort()
+        self.pts = array("d", (pts for pts, key in packets))
+        self.keyframes = array("I", (i for i, (pts, key) in enumerate(packets) if key))
+        self.save()
+        return True
+
+    def save(self):
+        tmp = self.path.with_suffix(".tmp")
+        with open(tmp, "wb") as f:
+            f.write(HEADER.pack(len(self.pts), len(self.keyframes)))
+            self.pts.tofile(f)
+            self.keyframes.tofile(f)
+        os.replace(tmp, self.path)
+
+    def load(self):
+        try:
+            with open(self.path, "rb") as f:
+                frames, keyframes = HEADER.unpack(f.read(HEADER.size))
+                self.pts = array("d")
+                self.pts.fromfile(f, frames)
+                self.keyframes = array("I")
+                self.keyframes.fromfile(f, keyframes)
+        except (OSError, EOFError, struct.error):
+            return False
+        return len(self.pts) > 0
+
+    def frame_duration(self, frame):
+        if frame + 1 < len(self.pts):
+            return self.pts[frame + 1] - self.pts[frame]
+        return self.pts[-1] - self.pts[-2] if len(self.pts) > 1 else 0.04
+
+    def frame_at(self, timestamp):
+        # the frame boundary nearest to a timestamp, len(pts) is the end of the last frame
+        i = bisect.bisect_left(self.pts, timestamp)
+        if i == len(self.pts):
+            end = self.pts[-1] + self.frame_duration(len(self.pts) - 1)
+            return i if timestamp - self.pts[-1] >= end - timestamp else i - 1
+        if i > 0 and timestamp - self.pts[i - 1] < self.pts[i] - timestamp:
+            return i - 1
+        return i
+
+    def keyframe_before(self, frame):
+        i = bisect.bisect_right(self.keyframes, frame) - 1
+        return self.keyframes[i] if i >= 0 else 0
+
+    def keyframe_after(self, frame):
+        i = bisect.bisect_left(self.keyframes, frame)
+        return self.keyframes[i] if i < len(self.keyframes) else None
+
+    def keyframe_near(self, frame, window):
+        candidates = [k for k in (self.keyframe_before(frame), self.keyframe_after(frame))
+                      if k is not None and abs(k - frame) <= window]
+        return min(candidates, key=lambda k: abs(k - frame)) if candidates else None
+
+    def boundary(self, frame):
+        # midway between a frame and the one before, robust against rounding in either timestamp
+        if frame <= 0:
+            return self.pts[0] - self.frame_duration(0) / 2
+        if frame >= len(self.pts):
+            return self.pts[-1] + self.frame_duration(len(self.pts) - 1) / 2
+        return (self.pts[frame - 1] + self.pts[frame]) / 2
+
+    def seek_time(self, keyframe):
+        # half a frame past the keyframe, a fast seek then lands on it and not the one before
+        return self.pts[keyframe] + self.frame_duration(keyframe) / 2
@@ -0,0 +1,225 @@
+import subprocess
+import threading
+import queue
+import ivf
+
+# a decoder that ran out of its own scenes only takes over a stretch at least this long, in seconds
+MIN_STEAL = 10.0
+
+
+class FrameServer:
+
+    def __init__(self, source, temp_location, crop, resolution, source_fps, stop_event, buffer_mb=1024,
+                 encoder_params=None, layout=None, chunk_format="mp4", chunk_params=None):
+        self.source = source
+        self.temp_location = temp_location
+        self.crop = crop
+        self.resolution = resolution
+        self.source_fps = source_fps
+        self.stop_event = stop_event
+        self.encoder_params = encoder_params or ["-c:v", "libsvtav1", "-preset", "4", "-pix_fmt", "yuv420p10le"]
+        self.layout = layout
+        self.chunk_format = chunk_format
+        # extra encoder arguments per chunk, e.g. the CRF found for it
+        self.chunk_params = chunk_params
+        x, y = resolution
+        # yuv420p10le: 2 bytes per sample, two quarter-size chroma planes
+        self.frame_size = x * y * 2 + 2 * ((x + 1) // 2) * ((y + 1) // 2) * 2
+        self.buffer_frames = max(int(buffer_mb * 1024 * 1024 / self.frame_size), 1)
+        self.jobs = queue.Queue()
+        # [next scene start, end] of the stretch of the source each decoder walks in order
+        self.spans = []
+        self.lock = threading.Lock()
+        # encoders writing a chunk, only they free space while the disk is full
+        self.encoding = 0
+
+    def run(self, scene_manager, workers, length):
+        # one decoder per worker, each streams its own stretch of the source and only seeks to start one
+        first = scene_manager.first_unfinished_scene()
+        start = scene_manager.scenes[first].start if first < len(scene_manager.scenes) else length
+        step = (length - start) / workers
+        self.spans = [[start + i * step, start + (i + 1) * step] for i in range(0, workers)]
+        max_frames = max(self.buffer_frames // workers, 1)
+        decoders = [threading.Thread(target=self.serve, args=(scene_manager, i, max_frames))
+                    for i in range(0, workers)]
+        try:
+            for t in decoders:
+                t.daemon = True
+                t.start()
+            for t in decoders:
+                t.join()
+        finally:
+            for i in range(0, workers):
+                self.jobs.put(None)
+
+    def claim(self, scene_manager, span, previous=None):
+        # the next scene starting in the decoder's span, and whether it directly follows the previous one
+        while not self.stop_event.is_set():
+            with self.lock:
+                start, end = self.spans[span]
+                if start >= end and not self.steal(span):
+                    return None, None, False
+                start = self.spans[span][0]
+            scene = scene_manager.request_scene_at_time(start)
+            with self.lock:
+                end = self.spans[span][1]
+                if scene is None or scene.start >= end:
+                    # nothing left, or the rest was taken by another decoder
+                    self.spans[span][0] = end
+                    continue
+                self.spans[span][0] = scene.end
+            # a scene starting before the span belongs to the decoder before, finished ones to a previous run
+            if scene.start >= start and not scene.done_processing:
+                return scene, scene.index, previous is not None and scene.index == previous + 1
+        return None, None, False
+
+    def steal(self, span):
+        # the back half of the longest span left, both decoders keep streaming in order
+        victim = max(range(0, len(self.spans)), key=lambda i: self.spans[i][1] - self.spans[i][0])
+        start, end = self.spans[victim]
+        if end - start < MIN_STEAL:
+            return False
+        middle = (start + end) / 2
+        self.spans[span] = [middle, end]
+        self.spans[victim][1] = middle
+        return True
+
+    def serve(self, scene_manager, span, max_frames):
+        buffer = threading.Semaphore(max_frames)
+        decoder = None
+        carry = None
+        index = None
+        try:
+            while not self.stop_event.is_set():
+                scene, index, follows = self.claim(scene_manager, span, index)
+                if scene is None:
+                    break
+                if decoder is None or not follows:
+                    self.stop_decoder(decoder)
+                    decoder = self.start_decoder(scene.start)
+                    base = scene.start
+                    frame_number = 0
+                    carry = None
+                frames = self.start_chunk(scene, index, buffer)
+                try:
+                    while not self.stop_event.is_set():
+                        if carry is not None:
+                            frame, carry = carry, None
+                        else:
+                            frame = decoder.stdout.read(self.frame_size)
+                            if len(frame) < self.frame_size:
+                                decoder = self.stop_decoder(decoder)
+                                break
+                            frame_number += 1
+                        timestamp = base + (frame_number - 0.5) / self.source_fps
+                        if timestamp >= scene.end:
+                            # the first frame of a later scene, kept in case this decoder claims that one next
+                            carry = frame
+                            break
+                        buffer.acquire()
+                        frames.put(frame)
+                finally:
+                    self.finish_chunk(frames)
+        finally:
+            self.stop_decoder(decoder)
+
+    def start_decoder(self, start):
+        x, y = self.resolution
+        if self.crop:
+            filter_str = self.crop + ",scale=" + str(x) + ":" + str(y)
+        else:
+            filter_str = "scale=" + str(x) + ":" + str(y)
+        return subprocess.Popen(
+            ["ffmpeg", "-ss", str(start), "-i", self.source, "-nostdin", "-loglevel", "fatal",
+             "-map", "0:v:0", "-vf", filter_str, "-pix_fmt", "yuv420p10le",
+             "-f", "rawvideo", "-"],
+            stdout=subprocess.PIPE, stderr=subprocess.DEVNULL
+        )
+
+    @staticmethod
+    def stop_decoder(decoder):
+        if decoder is not None:
+            if decoder.poll() is None:
+                decoder.kill()
+            decoder.stdout.close()
+            decoder.wait()
+        return None
+
+    def start_chunk(self, scene, index, buffer):
+        frames = queue.Queue()
+        self.jobs.put((scene, index, frames, buffer))
+        return frames
+
+    @staticmethod
+    def finish_chunk(frames):
+        if frames is not None:
+            frames.put(None)
+
+    def running(self):
+        with self.lock:
+            return self.encoding
+
+    @staticmethod
+    def drain(frames, buffer):
+        while frames.get() is not None:
+            buffer.release()
+
+    def encoder(self, scene_manager, slot=0):
+        while True:
+            job = self.jobs.get()
+            if job is None:
+                break
+            scene, index, frames, buffer = job
+            if self.stop_event.is_set():
+                self.drain(frames, buffer)
+                continue
+            x, y = self.resolution
+            # frames queue up in the buffer while the temp disk is full
+            if not scene_manager.storage.wait_for_space(scene.get_length(), self.stop_event, self.running):
+                self.drain(frames, buffer)
+                if not self.stop_event.is_set():
+                    scene_manager.scene_failed(scene, "not enough space left in the temp folder")
+                continue
+            with self.lock:
+                self.encoding += 1
+            path = scene_manager.place_chunk(scene)
+            params = self.chunk_params(scene, slot) if self.chunk_params else []
+            encoder = subprocess.Popen(
+                ["ffmpeg", "-y", "-f", "rawvideo", "-pix_fmt", "yuv420p10le", "-s", f"{x}x{y}",
+                 "-r", str(self.source_fps), "-i", "-", "-nostdin", "-loglevel", "fatal"] + self.encoder_params +
+                params + [str(path)],
+                stdin=subprocess.PIPE, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+            )
+            if self.layout:
+                self.layout.pin(encoder, slot)
+            broken = False
+            while True:
+                frame = frames.get()
+                if frame is None:
+                    break
+                # keep draining after a failed encoder so the decoder never stalls
+                if not broken and not self.stop_event.is_set():
+                    try:
+                        encoder.stdin.write(frame)
+                    except (BrokenPipeError, OSError):
+                        broken = True
+                buffer.release()
+            try:
+                encoder.stdin.close()
+            except (BrokenPipeError, OSError):
+                broken = True
+            if self.stop_event.is_set():
+                encoder.kill()
+            encoder.wait()
+            with self.lock:
+                self.encoding -= 1
+            if self.chunk_format == "ivf" and not broken and encoder.returncode == 0:
+                broken = not ivf.check(path)
+            success = not broken and encoder.returncode == 0 and not self.stop_event.is_set()
+            scene_manager.storage.release(path, scene.get_length() if success else None)
+            if success:
+                scene_manager.scene_finished(scene)
+            elif not self.stop_event.is_set():
+                # the frames are gone, the chunk is left for the next run
+                scene_manager.scene_failed(scene, f"exit code {encoder.returncode}" if encoder.returncode
+                                           else "encoder stopped reading frames")
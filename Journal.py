@@ -0,0 +1,68 @@
+import json
+import os
+from time import time
+
+filename = "journal.jsonl"
+
+
+class Journal:
+    # append-only record of scene changes, replayed on top of the last snapshot
+
+    def __init__(self, temp_location, sync_every=64, sync_interval=5.0):
+        self.path = temp_location / filename
+        self.sync_every = sync_every
+        self.sync_interval = sync_interval
+        self.pending = 0
+        self.last_sync = time()
+        self.records = 0
+        self.file = None
+
+    def exists(self):
+        return os.path.exists(self.path)
+
+    def read(self):
+        records = []
+        if not self.exists():
+            return records
+        with open(self.path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    records.append(json.loads(line))
+                except json.JSONDecodeError:
+                    # torn write at the end of a crashed run
+                    break
+        self.records = len(records)
+        return records
+
+    def append(self, *record):
+        if self.file is None:
+            self.file = open(self.path, "a", encoding="utf-8")
+        self.file.write(json.dumps(record) + "\n")
+        self.file.flush()
+        self.records += 1
+        self.pending += 1
+        if self.pending >= self.sync_every or time() - self.last_sync >= self.sync_interval:
+            self.sync()
+
+    def sync(self):
+        if self.file is not None and self.pending:
+            os.fsync(self.file.fileno())
+        self.pending = 0
+        self.last_sync = time()
+
+    def truncate(self):
+        self.close()
+        self.file = open(self.path, "w", encoding="utf-8")
+        os.fsync(self.file.fileno())
+        self.records = 0
+
+    def close(self):
+        if self.file is not None:
+            self.sync()
+            self.file.close()
+            self.file = None
+
+    def remove(self):
+        self.close()
+        if self.exists():
+            os.remove(self.path)
@@ -0,0 +1,125 @@
+import json
+import os
+import threading
+from time import time
+
+# latest textfile values of every file sharing a path, a batch writes them all into the one file
+textfiles = {}
+textfiles_lock = threading.Lock()
+
+
+class Metrics:
+
+    def __init__(self, path=None, workers=1, source=None):
+        self.path = path
+        self.workers = workers
+        # tells apart the records of the files in a batch
+        self.source = None if source is None else str(source)
+        self.lock = threading.Lock()
+        self.detection_start = None
+        self.detection_end = None
+        self.last_sample = None
+        self.idle_time = 0.0
+        self.overlap_time = 0.0
+        self.chunk_count = 0
+        self.chunk_wall_time = 0.0
+        self.chunk_frames = 0
+
+    def detection_started(self):
+        self.detection_start = time()
+
+    def detection_finished(self):
+        self.detection_end = time()
+
+    def detection_running(self):
+        return self.detection_start is not None and self.detection_end is None
+
+    def chunk_finished(self, attempt, won, error=None):
+        record = {"event": "chunk", "time": time(), "source": self.source, "index": attempt.scene.index,
+                  "attempt": attempt.number, "preset": attempt.preset, "length": attempt.scene.get_length(),
+                  "wall_time": attempt.elapsed(), "frames": attempt.frame,
+                  "fps": attempt.frame / attempt.elapsed() if attempt.elapsed() > 0 else 0.0,
+                  "won": won, "cancelled": attempt.cancelled, "error": error}
+        with self.lock:
+            if won:
+                self.chunk_count += 1
+                self.chunk_wall_time += record["wall_time"]
+                self.chunk_frames += attempt.frame
+            self.write_event(record)
+
+    def sample(self, scene_manager):
+        with scene_manager.lock:
+            attempts = [a for attempts in scene_manager.attempts.values() for a in attempts if not a.cancelled]
+            complete = len(scene_manager.scenes) - (0 if scene_manager.scd_finished else 1)
+            queue_depth = complete - scene_manager.done_count - scene_manager.processing_count
+            in_flight = {}
+            for a in attempts:
+                in_flight[a.scene.index] = max(in_flight.get(a.scene.index, 0.0), a.position)
+            snapshot = {
+                "event": "sample", "time": time(), "source": self.source,
+                "scenes": len(scene_manager.scenes), "chunks_done": scene_manager.done_count,
+                "queue_depth": queue_depth, "busy_workers": len(attempts),
+                "encoder_fps": sum(a.fps for a in attempts),
+                "done_length": scene_manager.done_length,
+                "in_flight_length": sum(in_flight.values()),
+                "wasted_time": scene_manager.wasted_time,
+                "wasted_attempts": scene_manager.wasted_attempts,
+            }
+        with self.lock:
+            now = snapshot["time"]
+            if self.last_sample is not None:
+                elapsed = now - self.last_sample
+                self.idle_time += max(self.workers - len(attempts), 0) * elapsed
+                if self.detection_running() and attempts:
+                    self.overlap_time += elapsed
+            self.last_sample = now
+            snapshot.update({"idle_worker_time": self.idle_time, "detection_overlap_time": self.overlap_time,
+                             "detection_running": self.detection_running(),
+                             "chunk_wall_time": self.chunk_wall_time, "chunk_count": self.chunk_count})
+            self.export(snapshot)
+        return snapshot
+
+    def export(self, snapshot):
+        if self.path is None:
+            return
+        if str(self.path).endswith(".prom"):
+            self.write_textfile(snapshot)
+        else:
+            self.write_event(snapshot)
+
+    def write_event(self, record):
+        if self.path is None or str(self.path).endswith(".prom"):
+            return
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(record) + "\n")
+
+    def write_textfile(self, snapshot):
+        # node_exporter textfile collector format, replaced atomically
+        values = [
+            ("chunks_total", "gauge", snapshot["scenes"]),
+            ("chunks_done", "gauge", snapshot["chunks_done"]),
+            ("queue_depth", "gauge", snapshot["queue_depth"]),
+            ("busy_workers", "gauge", snapshot["busy_workers"]),
+            ("encoder_fps", "gauge", snapshot["encoder_fps"]),
+            ("detection_running", "gauge", int(snapshot["detection_running"])),
+            ("idle_worker_seconds_total", "counter", snapshot["idle_worker_time"]),
+            ("detection_overlap_seconds_total", "counter", snapshot["detection_overlap_time"]),
+            ("wasted_seconds_total", "counter", snapshot["wasted_time"]),
+            ("chunk_wall_seconds_total", "counter", snapshot["chunk_wall_time"]),
+            ("chunks_encoded_total", "counter", snapshot["chunk_count"]),
+        ]
+        label = ""
+        if self.source is not None:
+            label = '{source="' + self.source.replace("\\", "\\\\").replace('"', '\\"') + '"}'
+        with textfiles_lock:
+            files = textfiles.setdefault(str(self.path), {})
+            files[label] = values
+            lines = []
+            for i, (name, kind, value) in enumerate(values):
+                lines.append(f"# TYPE chunked_encoding_{name} {kind}")
+                for file_label, file_values in files.items():
+                    lines.append(f"chunked_encoding_{name}{file_label} {file_values[i][2]}")
+            tmp = f"{self.path}.{os.getpid()}.tmp"
+            with open(tmp, "w", encoding="utf-8") as f:
+                f.write("\n".join(lines) + "\n")
+            os.replace(tmp, self.path)
\ No newline at end of file
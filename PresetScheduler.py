@@ -0,0 +1,34 @@
+from time import time
+
+# rough SVT-AV1 throughput per preset, only the ratios matter, the cost model learns the absolute speed
+PRESET_SPEED = {-1: 0.02, 0: 0.04, 1: 0.08, 2: 0.18, 3: 0.45, 4: 1.0, 5: 1.6, 6: 2.4, 7: 3.4, 8: 4.8,
+                9: 6.2, 10: 7.8, 11: 9.6, 12: 12.0, 13: 14.5}
+
+
+class PresetScheduler:
+    # gives every chunk the slowest preset that still lands the whole job on the deadline
+
+    def __init__(self, deadline, reference=4, min_preset=2, max_preset=12):
+        self.deadline = deadline
+        self.reference = reference
+        self.min_preset = max(min(min_preset, max_preset), min(PRESET_SPEED))
+        self.max_preset = min(max(min_preset, max_preset), max(PRESET_SPEED))
+
+    def speed(self, preset):
+        return PRESET_SPEED[preset] / PRESET_SPEED[self.reference]
+
+    def choose(self, scene_manager, end, workers):
+        work = scene_manager.remaining_work(end)
+        if work is None:
+            # nothing measured yet, the first chunks run at the reference preset
+            return min(max(self.reference, self.min_preset), self.max_preset)
+        queued, running = work
+        # worker seconds left once the running chunks are through
+        capacity = (self.deadline - time()) * workers - running
+        if capacity <= 0:
+            return self.max_preset
+        needed = queued / capacity
+        for preset in range(self.min_preset, self.max_preset + 1):
+            if self.speed(preset) >= needed:
+                return preset
+        return self.max_preset
@@ -1,7 +1,12 @@
 class Scene:
-    def __init__(self, start):
+    __slots__ = ("start", "end", "index", "complexity", "is_processing", "done_processing")
+
+    def __init__(self, start, index=0):
         self.start = start
         self.end = None
+        self.index = index
+        # mean scene change score over the scene, None when unknown
+        self.complexity = None
         self.is_processing = False
         self.done_processing = False
 
@@ -18,11 +23,13 @@ class Scene:
             return float("inf")
 
     def serialize(self):
-        return self.__dict__
+        return {name: getattr(self, name) for name in self.__slots__}
 
     @classmethod
     def deserialize(cls, data):
         start_value = data.pop('start')
         instance = cls(start_value)
-        instance.__dict__.update(data)
+        for name, value in data.items():
+            if name in cls.__slots__:
+                setattr(instance, name, value)
         return instance
\ No newline at end of file
@@ -0,0 +1,65 @@
+from array import array
+import os
+
+filename = "scores-{}-{}.bin"
+# a forced cut only moves back to an earlier change this strong, relative to the threshold
+WEAK_CHANGE = 0.5
+
+
+class CutFinder:
+
+    def __init__(self, start, threshold=0.25, min_length=1.0, max_length=None):
+        self.last_cut = start
+        self.threshold = threshold
+        self.min_length = min_length
+        self.max_length = max_length
+        self.window = []
+
+    def feed(self, timestamp, score):
+        if timestamp - self.last_cut <= self.min_length:
+            return []
+        if score > self.threshold:
+            self.cut(timestamp)
+            return [timestamp]
+        self.window.append((timestamp, score))
+        if self.max_length and timestamp - self.last_cut >= self.max_length:
+            # scene got too long, cut at the latest of the strongest changes seen since the minimum,
+            # or right here when none stands out
+            best, score = max(reversed(self.window), key=lambda w: w[1])
+            if score < self.threshold * WEAK_CHANGE:
+                best = timestamp
+            self.cut(best)
+            return [best]
+        return []
+
+    def cut(self, timestamp):
+        self.last_cut = timestamp
+        self.window = [w for w in self.window if w[0] - timestamp > self.min_length]
+
+
+class SceneIndex:
+    # flat array of (pts_time, scene score) pairs for every analysed frame
+
+    def __init__(self, temp_location, width=None, step=1):
+        self.path = temp_location / filename.format(width or "full", step)
+
+    def exists(self):
+        return os.path.exists(self.path)
+
+    def save(self, values):
+        tmp = self.path.with_suffix(".tmp")
+        with open(tmp, "wb") as f:
+            values.tofile(f)
+        os.replace(tmp, self.path)
+
+    def load(self):
+        values = array("d")
+        with open(self.path, "rb") as f:
+            values.frombytes(f.read())
+        return values
+
+    def frames(self, end):
+        values = self.load()
+        for i in range(0, len(values), 2):
+            if values[i] < end:
+                yield values[i], values[i + 1]
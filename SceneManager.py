@@ -1,82 +1,476 @@
 import json
 from Scene import *
+from Journal import Journal
+from Attempt import Attempt
+from TempStorage import TempStorage
 from time import *
 import threading
+import heapq
+import bisect
 import os
 
 filename = "scenes.json"
+settings_filename = "settings.json"
+compact_every = 1000
+# straggler copies are only worth starting for chunks that still need a while
+min_straggler_time = 10.0
+max_attempts = 2
+# a failed chunk is retried this often, waiting twice as long each time
+max_retries = 3
+retry_backoff = 5.0
+# the ready heap is only re-keyed once the cost model's shape moved this much
+reorder_change = 0.05
 
 class SceneManager:
-    def __init__(self, temp_location, content_start_time):
+    def __init__(self, temp_location, content_start_time, min_length=1.0, settings=None, cost_model=None, lock=None,
+                 chunk_format="mp4", storage=None):
         self.temp_location = temp_location
+        self.chunk_format = chunk_format
+        self.storage = storage or TempStorage(temp_location)
+        self.cost_model = cost_model
+        self.min_length = min_length
+        self.settings = settings or {}
         self.scenes = []
         self.start_timestamp = time()
         self.most_recent_timestamp = None
         self.finished_length = 0.0
-        self.lock = threading.Condition()
+        # max-heap of (-predicted cost, index) for complete scenes waiting for a worker
+        self.ready = []
+        # cost model shape the ready heap was keyed with
+        self.ready_shape = None
+        # length and length * complexity of complete scenes not done yet, for the ETA
+        self.pending_length = 0.0
+        self.pending_complexity = 0.0
+        self.done_count = 0
+        self.processing_count = 0
+        self.done_length = 0.0
+        # running encodes per scene index, more than one while a straggler is duplicated
+        self.attempts = {}
+        self.encode_time = 0.0
+        self.encoded_length = 0.0
+        self.wasted_time = 0.0
+        self.wasted_attempts = 0
+        # errors per scene index, scenes given up on, and retries waiting out their backoff
+        self.failures = {}
+        self.failed = set()
+        self.retrying = 0
+        self.stopped = False
+        # batch mode shares one condition between all files so idle workers wake for any of them
+        self.lock = lock or threading.Condition()
         self.scd_finished = False
 
-        if os.path.exists(self.temp_location / filename):
-            self.load_scenes()
+        self.journal = Journal(self.temp_location)
+
+        resumable = os.path.exists(self.temp_location / filename) or self.journal.exists()
+        if resumable and self.load_settings() == self.settings:
+            self.load_scenes(content_start_time)
         else:
+            self.journal.remove()
+            if os.path.exists(self.temp_location / filename):
+                os.remove(self.temp_location / filename)
+            self.save_settings()
             self.scenes.append(Scene(content_start_time))
 
-    def add_scene(self, timestamp):
+    def cost(self, scene):
+        if self.cost_model is None:
+            return scene.get_length()
+        return self.cost_model.predict(scene.get_length(), scene.complexity)
+
+    def push_ready(self, scene):
+        heapq.heappush(self.ready, (-self.cost(scene), scene.index))
+
+    def scene_ready(self, scene):
+        self.pending_length += scene.get_length()
+        self.pending_complexity += scene.get_length() * (scene.complexity or 0.0)
+        self.push_ready(scene)
+
+    def reordered(self):
+        # the model learns a little from every chunk, the order of the queue rarely changes with it
+        shape = self.cost_model.shape()
+        if shape is None or self.ready_shape is None:
+            return shape != self.ready_shape
+        return abs(shape - self.ready_shape) > reorder_change * (1.0 + abs(self.ready_shape))
+
+    def reprioritize(self):
+        # costs change as the model learns, rebuild the heap from the live entries
+        self.ready = [(-self.cost(self.scenes[index]), index) for length, index in self.ready
+                      if not self.scenes[index].is_processing and not self.scenes[index].done_processing]
+        heapq.heapify(self.ready)
+        self.ready_shape = self.cost_model.shape()
+
+    def add_scene(self, timestamp, complexity=None):
         with self.lock:
-            idx = len(self.scenes) - 1
-            self.scenes[idx].end_scene(timestamp)
-            self.scenes.append(Scene(timestamp))
-            if not self.scenes[idx].get_length() > 1.0:
-                self.scenes[idx].end_scene(None)
-                self.scenes.pop(idx + 1)
-            self.lock.notify_all()
+            scene = self.scenes[-1]
+            if timestamp - scene.start > self.min_length:
+                scene.end_scene(timestamp)
+                scene.complexity = complexity
+                self.scene_ready(scene)
+                self.scenes.append(Scene(timestamp, len(self.scenes)))
+                self.journal.append("add", len(self.scenes) - 1, timestamp, complexity)
+                self.lock.notify_all()
+                return True
+            return False
 
-    def finish_last_scene(self, timestamp):
+    def finish_last_scene(self, timestamp, complexity=None):
         with self.lock:
-            self.scenes[len(self.scenes)-1].end_scene(timestamp)
+            scene = self.scenes[-1]
+            scene.end_scene(timestamp)
+            scene.complexity = complexity
+            if not scene.done_processing:
+                self.scene_ready(scene)
             self.scd_finished = True
+            self.journal.append("end", timestamp, complexity)
+            self.journal.sync()
             self.lock.notify_all()
 
     def request_scene(self):
         with self.lock:
             while True:
-                available_scenes = [s for s in self.scenes if s.is_complete()
-                                    and not s.is_processing and not s.done_processing]
-                if available_scenes:
-                    available_scenes.sort(key=lambda s: s.get_length(), reverse=True)
-                    scene = available_scenes[0]
-                    scene.is_processing = True
-                    return scene, self.scenes.index(scene)
-                if self.scd_finished:
+                scene, index = self.poll_scene()
+                if scene is not None:
+                    return scene, index
+                if self.stopped or self.scd_finished and not self.retrying:
                     return None, None
                 self.lock.wait()
 
+    def poll_scene(self):
+        with self.lock:
+            while self.ready and not self.stopped:
+                length, index = heapq.heappop(self.ready)
+                scene = self.scenes[index]
+                # entries are dropped lazily once a scene was taken another way
+                if not scene.is_processing and not scene.done_processing:
+                    self.mark_processing(scene)
+                    return scene, index
+            return None, None
+
+    def wait_for_requeue(self, timeout):
+        # leased chunks can come back after the queue ran dry, stay around while any are out
+        with self.lock:
+            if not self.ready and self.attempts:
+                self.lock.wait(timeout)
+            return bool(self.ready or self.attempts or self.retrying)
+
+    def finished(self):
+        # every scene is done or given up on
+        with self.lock:
+            return self.scd_finished and not self.retrying and self.done_count + len(self.failed) >= len(self.scenes)
+
+    def mark_processing(self, scene):
+        if not scene.is_processing:
+            scene.is_processing = True
+            self.processing_count += 1
+            self.journal.append("start", scene.index)
+
+    def predicted_remaining(self, end):
+        # encode seconds left for all workers together, None until the model has data
+        with self.lock:
+            if self.cost_model is None or not self.cost_model.trained():
+                return None
+            remaining = self.cost_model.predict_sum(self.pending_length, self.pending_complexity)
+            if not self.scd_finished:
+                remaining += self.cost_model.predict(end - self.scenes[-1].start, None)
+            for index, attempts in self.attempts.items():
+                remaining -= min(max(a.elapsed() for a in attempts), self.cost(self.scenes[index]))
+            return max(remaining, 0.0)
+
+    def remaining_work(self, end):
+        # reference encode seconds still queued, and wall seconds left on the running chunks
+        with self.lock:
+            if self.cost_model is None or not self.cost_model.trained():
+                return None
+            queued = self.cost_model.predict_sum(self.pending_length, self.pending_complexity)
+            if not self.scd_finished:
+                queued += self.cost_model.predict(end - self.scenes[-1].start, None)
+            rate = self.encode_time / self.encoded_length if self.encoded_length else None
+            running = 0.0
+            for index, attempts in self.attempts.items():
+                cost = self.cost(self.scenes[index])
+                queued -= cost
+                running += min([r for r in (a.predicted_remaining(rate) for a in attempts) if r is not None] + [cost])
+            return max(queued, 0.0), running
+
+    def request_straggler(self):
+        with self.lock:
+            rate = self.encode_time / self.encoded_length if self.encoded_length else None
+            straggler = None
+            longest = min_straggler_time
+            for index, attempts in self.attempts.items():
+                if len(attempts) >= max_attempts or self.scenes[index].done_processing:
+                    continue
+                # only copies that report progress are measured, a chunk that just started is not slow
+                measured = [a.predicted_remaining(rate) for a in attempts if a.position > 0]
+                if not measured:
+                    continue
+                remaining = min(measured)
+                if remaining > longest:
+                    straggler, longest = self.scenes[index], remaining
+            if straggler is None:
+                return None, None
+            return straggler, straggler.index
+
+    def chunk_name(self, index, number=0):
+        if number == 0:
+            return f"{index}.{self.chunk_format}"
+        return f"{index}.dup{number}.{self.chunk_format}"
+
+    def chunk_path(self, index):
+        return self.storage.path(self.chunk_name(index))
+
+    def place_chunk(self, scene, number=0, directory=None):
+        return self.storage.place(self.chunk_name(scene.index, number), scene.get_length(), directory)
+
+    def start_attempt(self, scene):
+        # None once the scene was finished or given back since it was handed out, or the job was stopped
+        with self.lock:
+            if self.stopped or scene.done_processing or not scene.is_processing:
+                return None
+            attempts = self.attempts.setdefault(scene.index, [])
+            number = len(attempts)
+            # a duplicate is written on the tier of the copy it races, whichever wins keeps the one chunk name there
+            directory = attempts[0].path.parent if attempts else None
+            attempt = Attempt(scene, number, self.place_chunk(scene, number, directory))
+            attempts.append(attempt)
+            return attempt
+
+    def running(self):
+        # chunks of this job being encoded right now
+        with self.lock:
+            return len(self.attempts)
+
+    def give_up(self, scene, error):
+        # a chunk that could not be started goes through the retries like a failed one
+        with self.lock:
+            if scene.is_processing and not scene.done_processing:
+                self.retry(scene, error)
+
+    def renew(self, attempt, seconds):
+        with self.lock:
+            attempt.deadline = time() + seconds
+
+    def expired_leases(self):
+        with self.lock:
+            now = time()
+            return [a for attempts in self.attempts.values() for a in attempts
+                    if a.deadline is not None and a.deadline < now and not a.cancelled]
+
+    def release(self, scene):
+        # back into the queue for the next worker, local or remote
+        scene.is_processing = False
+        self.processing_count -= 1
+        self.push_ready(scene)
+        self.lock.notify_all()
+
+    def retry(self, scene, error):
+        self.failures.setdefault(scene.index, []).append(error)
+        scene.is_processing = False
+        self.processing_count -= 1
+        count = len(self.failures[scene.index])
+        if count > max_retries:
+            self.failed.add(scene.index)
+            self.lock.notify_all()
+            return
+        self.retrying += 1
+        timer = threading.Timer(retry_backoff * 2 ** (count - 1), self.retry_ready, args=(scene,))
+        timer.daemon = True
+        timer.start()
+
+    def retry_ready(self, scene):
+        with self.lock:
+            self.retrying -= 1
+            if not scene.is_processing and not scene.done_processing:
+                self.push_ready(scene)
+            self.lock.notify_all()
+
+    def scene_failed(self, scene, error):
+        # for chunks that cannot be encoded again in this run
+        with self.lock:
+            if scene.done_processing:
+                return
+            self.failures.setdefault(scene.index, []).append(error)
+            if scene.is_processing:
+                scene.is_processing = False
+                self.processing_count -= 1
+            self.failed.add(scene.index)
+            self.lock.notify_all()
+
+    def stop(self):
+        # wakes every waiting worker empty handed and kills the running encoders
+        with self.lock:
+            self.stopped = True
+            self.lock.notify_all()
+            for attempts in self.attempts.values():
+                for attempt in attempts:
+                    attempt.cancel()
+
+    def attempt_finished(self, attempt, success, requeue=False, error=None):
+        with self.lock:
+            scene = attempt.scene
+            attempts = self.attempts.get(scene.index, [])
+            # the chunk stays on the tier it was written to
+            final_path = attempt.path.parent / self.chunk_name(scene.index)
+            won = success and not attempt.cancelled and not scene.done_processing
+            if won and attempt.path != final_path:
+                try:
+                    os.replace(attempt.path, final_path)
+                except OSError as e:
+                    won = False
+                    error = f"could not keep the chunk: {e}"
+            if won:
+                self.storage.remove_other(final_path)
+            self.storage.release(attempt.path, scene.get_length() if won else None)
+            if won:
+                # first copy to finish wins, the others are killed
+                for other in attempts:
+                    if other is not attempt:
+                        self.wasted_time += other.elapsed()
+                        self.wasted_attempts += 1
+                        other.cancel()
+                self.attempts.pop(scene.index, None)
+                self.encode_time += attempt.elapsed()
+                self.encoded_length += scene.get_length()
+                if self.cost_model is not None:
+                    self.cost_model.observe(scene.get_length(), scene.complexity, attempt.elapsed() * attempt.speed)
+                    if self.reordered():
+                        self.reprioritize()
+                self.scene_finished(scene)
+                return True
+            if attempt.path != final_path or not scene.done_processing:
+                if os.path.exists(attempt.path):
+                    os.remove(attempt.path)
+            if attempt in attempts:
+                attempts.remove(attempt)
+                if not attempts:
+                    self.attempts.pop(scene.index, None)
+            # a copy still running may yet succeed, a cancelled one was stopped on purpose
+            if scene.is_processing and not scene.done_processing and scene.index not in self.attempts:
+                if requeue:
+                    self.release(scene)
+                elif not attempt.cancelled:
+                    self.retry(scene, error)
+            return False
+
+    def request_scene_at_time(self, timestamp):
+        # the scene playing at the timestamp once detected, only taken when it starts there or later
+        with self.lock:
+            while not self.stopped:
+                index = max(bisect.bisect_right(self.scenes, timestamp, key=lambda s: s.start) - 1, 0)
+                scene = self.scenes[index]
+                if scene.is_complete():
+                    if timestamp >= scene.end:
+                        # past the end of the source
+                        return None
+                    if scene.start >= timestamp and not scene.done_processing:
+                        self.mark_processing(scene)
+                    return scene
+                self.lock.wait()
+            return None
+
+    def requeue_missing(self, first):
+        # chunks staged in RAM do not survive a reboot, those scenes are encoded again
+        with self.lock:
+            for scene in self.scenes[first:]:
+                if scene.done_processing and not self.storage.exists(self.chunk_name(scene.index)):
+                    scene.done_processing = False
+                    self.done_count -= 1
+                    self.done_length -= scene.get_length()
+                    self.scene_ready(scene)
+            self.lock.notify_all()
+
+    def first_unfinished_scene(self):
+        with self.lock:
+            for index, scene in enumerate(self.scenes):
+                if not scene.done_processing:
+                    return index
+            return len(self.scenes)
+
     def unprocessed_scenes(self):
-        return any(not scene.done_processing for scene in self.scenes)
+        return self.done_count < len(self.scenes)
 
     def scene_finished(self, scene):
         with self.lock:
+            if scene.done_processing:
+                return
+            if scene.is_processing:
+                self.processing_count -= 1
             scene.done_processing = True
             scene.is_processing = False
+            self.done_count += 1
+            self.done_length += scene.get_length()
+            self.pending_length -= scene.get_length()
+            self.pending_complexity -= scene.get_length() * (scene.complexity or 0.0)
             self.most_recent_timestamp = time()
             self.finished_length += scene.get_length()
-            if self.scd_finished:
-                self.save_scenes()
+            self.journal.append("finish", scene.index)
+            self.lock.notify_all()
+            if self.journal.records >= compact_every:
+                self.compact()
+
+    def compact(self):
+        # the snapshot replaces the journal, records replayed twice are ignored
+        self.save_scenes()
+        self.journal.truncate()
 
     def save_scenes(self):
         serialized = [s.serialize() for s in self.scenes]
-        with open(self.temp_location / filename, "w") as f:
+        tmp = self.temp_location / (filename + ".tmp")
+        with open(tmp, "w") as f:
             json.dump(serialized, f, indent=4)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.temp_location / filename)
 
+    def save_settings(self):
+        with open(self.temp_location / settings_filename, "w") as f:
+            json.dump(self.settings, f, indent=4)
 
-    def load_scenes(self):
-        with open(self.temp_location / filename, "r", encoding="utf-8") as f:
-            serialized = json.load(f)
-            self.scenes = [Scene.deserialize(item) for item in serialized]
-            self.scd_finished = True
-            for scene in self.scenes:
-                if not scene.done_processing and scene.is_processing:
-                    scene.is_processing = False
+    def load_settings(self):
+        # scenes cut with different detection settings are not resumed
+        if not os.path.exists(self.temp_location / settings_filename):
+            return {}
+        with open(self.temp_location / settings_filename, "r", encoding="utf-8") as f:
+            return json.load(f)
+
+    def load_scenes(self, content_start_time):
+        if os.path.exists(self.temp_location / filename):
+            with open(self.temp_location / filename, "r", encoding="utf-8") as f:
+                serialized = json.load(f)
+                self.scenes = [Scene.deserialize(item) for item in serialized]
+        else:
+            self.scenes = [Scene(content_start_time)]
+        for record in self.journal.read():
+            self.replay(record)
+        # the last scene stays open until detection has finished
+        self.scd_finished = self.scenes[-1].is_complete()
+        for index, scene in enumerate(self.scenes):
+            scene.index = index
+            if not scene.done_processing and scene.is_processing:
+                scene.is_processing = False
+            if scene.done_processing:
+                self.done_count += 1
+                self.done_length += scene.get_length()
+            elif scene.is_complete():
+                self.scene_ready(scene)
+
+    def replay(self, record):
+        op = record[0]
+        if op == "add" and record[1] == len(self.scenes):
+            self.scenes[-1].end_scene(record[2])
+            self.scenes[-1].complexity = record[3] if len(record) > 3 else None
+            self.scenes.append(Scene(record[2], record[1]))
+        elif op == "end":
+            self.scenes[-1].end_scene(record[1])
+            self.scenes[-1].complexity = record[2] if len(record) > 2 else None
+        elif op == "finish" and record[1] < len(self.scenes):
+            self.scenes[record[1]].done_processing = True
+
+    def close(self):
+        with self.lock:
+            self.journal.close()
 
     def clean_up(self):
-        os.remove(self.temp_location / filename)
\ No newline at end of file
+        self.journal.remove()
+        if os.path.exists(self.temp_location / filename):
+            os.remove(self.temp_location / filename)
+        if os.path.exists(self.temp_location / settings_filename):
+            os.remove(self.temp_location / settings_filename)
\ No newline at end of file
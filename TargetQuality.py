@@ -0,0 +1,183 @@
+import json
+import os
+import re
+import subprocess
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+filename = "probes.json"
+MIN_CRF = 10
+MAX_CRF = 55
+PROBE_PRESET = 12
+# the second round probes again between the two probes around the target
+ROUNDS = 2
+METRIC_FILTERS = {"vmaf": "libvmaf", "ssim": "ssim", "psnr": "psnr"}
+METRIC_PATTERNS = {"vmaf": r"VMAF score[:=]\s*([\d.]+)", "ssim": r"All:([\d.]+)", "psnr": r"average:([\d.]+|inf)"}
+
+
+class TargetQuality:
+    # picks a CRF per chunk from fast low resolution probe encodes, scores are kept per chunk
+
+    def __init__(self, source, temp_location, crop, resolution, target, metric="vmaf", probes=4,
+                 probe_width=480, probe_step=1, layout=None, stop_event=None):
+        self.source = source
+        self.temp_location = temp_location
+        self.crop = crop
+        self.target = target
+        self.metric = metric
+        self.probes = max(probes, 2)
+        self.probe_step = max(probe_step, 1)
+        self.layout = layout
+        self.stop_event = stop_event or threading.Event()
+        # running probe encodes, killed when the job stops
+        self.processes = set()
+        x, y = resolution
+        width = min(probe_width, x)
+        self.probe_size = (width - width % 2, max(round(y * width / x / 2) * 2, 2))
+        # scores only carry over between runs that probe the same way, the target itself may change
+        self.settings = f"{metric}:{self.probe_size[0]}x{self.probe_size[1]}:{self.probe_step}:{PROBE_PRESET}"
+        self.lock = threading.Lock()
+        self.cache = self.load()
+
+    def find_crf(self, scene, slot=None):
+        # cached scores only stand in for probes, so a re-run takes the same steps without encoding
+        cached = self.scores(scene)
+        scores = {}
+        low, high = MIN_CRF, MAX_CRF
+        for i in range(0, ROUNDS):
+            if self.stop_event.is_set():
+                return None
+            if i == 0:
+                crfs = [round(low + j * (high - low) / (self.probes - 1)) for j in range(self.probes)]
+            else:
+                crfs = [round(low + j * (high - low) / (self.probes + 1)) for j in range(1, self.probes + 1)]
+            crfs = sorted(set(crf for crf in crfs if crf not in scores))
+            missing = [crf for crf in crfs if crf not in cached]
+            if missing:
+                with ThreadPoolExecutor(max_workers=len(missing)) as executor:
+                    results = list(executor.map(lambda crf: self.probe(scene, crf, slot), missing))
+                for crf, score in zip(missing, results):
+                    if score is not None:
+                        cached[crf] = score
+                self.store(scene, cached)
+            scores.update((crf, cached[crf]) for crf in crfs if crf in cached)
+            if not scores:
+                return None
+            low, high = self.bracket(scores)
+            if high - low <= 1:
+                break
+        return self.interpolate(scores)
+
+    def bracket(self, scores):
+        above = [crf for crf, score in scores.items() if score >= self.target]
+        low = max(above) if above else MIN_CRF
+        below = [crf for crf, score in scores.items() if score < self.target and crf > low]
+        high = min(below) if below else MAX_CRF
+        return low, high
+
+    def interpolate(self, scores):
+        above = [crf for crf, score in scores.items() if score >= self.target]
+        if not above:
+            # even the best probe misses the target
+            return min(scores)
+        low = max(above)
+        below = [crf for crf, score in scores.items() if score < self.target and crf > low]
+        if not below:
+            return low
+        high = min(below)
+        # rounded down, towards the side that meets the target
+        return int(low + (scores[low] - self.target) / (scores[low] - scores[high]) * (high - low))
+
+    def filters(self):
+        filters = [self.crop] if self.crop else []
+        filters.append(f"scale={self.probe_size[0]}:{self.probe_size[1]}")
+        if self.probe_step > 1:
+            filters.append(f"framestep={self.probe_step}")
+        return filters
+
+    def probe(self, scene, crf, slot=None):
+        path = self.temp_location / f"probe-{scene.index}-{crf}.mkv"
+        try:
+            encoded = self.run(
+                ["ffmpeg", "-y", "-ss", str(scene.start), "-to", str(scene.end), "-i", self.source, "-nostdin",
+                 "-loglevel", "fatal", "-an", "-map", "0:v:0", "-filter:v", ",".join(self.filters()),
+                 "-c:v", "libsvtav1", "-preset", str(PROBE_PRESET), "-crf", str(crf), "-pix_fmt", "yuv420p10le",
+                 path], slot, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+            )
+            if encoded is None or encoded.returncode != 0:
+                return None
+            graph = (f"[0:v]setpts=PTS-STARTPTS,format=yuv420p10le[dist];"
+                     f"[1:v]{','.join(self.filters())},setpts=PTS-STARTPTS,format=yuv420p10le[ref];"
+                     f"[dist][ref]{METRIC_FILTERS[self.metric]}")
+            scored = self.run(
+                ["ffmpeg", "-i", path, "-ss", str(scene.start), "-to", str(scene.end), "-i", self.source,
+                 "-nostdin", "-hide_banner", "-nostats", "-lavfi", graph, "-f", "null", "-"], slot,
+                stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True, errors="replace"
+            )
+        finally:
+            if os.path.exists(path):
+                os.remove(path)
+        if scored is None:
+            return None
+        matches = re.findall(METRIC_PATTERNS[self.metric], scored.stderr)
+        if scored.returncode != 0 or not matches:
+            return None
+        return float(matches[-1])
+
+    def run(self, args, slot=None, **kwargs):
+        # like subprocess.run, None once the job was stopped
+        if self.stop_event.is_set():
+            return None
+        process = subprocess.Popen(args, **kwargs)
+        if self.layout is not None:
+            self.layout.pin(process, slot)
+        with self.lock:
+            self.processes.add(process)
+            stopped = self.stop_event.is_set()
+        if stopped:
+            process.kill()
+        try:
+            stdout, stderr = process.communicate()
+        finally:
+            with self.lock:
+                self.processes.discard(process)
+        if stopped or self.stop_event.is_set():
+            return None
+        return subprocess.CompletedProcess(args, process.returncode, stdout, stderr)
+
+    def stop(self):
+        # set the stop event first, a probe started after this kills itself
+        with self.lock:
+            for process in self.processes:
+                if process.poll() is None:
+                    process.kill()
+
+    @staticmethod
+    def key(scene):
+        return f"{scene.start:.3f}-{scene.end:.3f}"
+
+    def scores(self, scene):
+        with self.lock:
+            scores = self.cache.get(self.key(scene), {}).get(self.settings, {})
+            return {int(crf): score for crf, score in scores.items()}
+
+    def store(self, scene, scores):
+        with self.lock:
+            self.cache.setdefault(self.key(scene), {})[self.settings] = dict(scores)
+            tmp = self.temp_location / (filename + ".tmp")
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(self.cache, f)
+            os.replace(tmp, self.temp_location / filename)
+
+    def load(self):
+        try:
+            with open(self.temp_location / filename, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, json.JSONDecodeError):
+            return {}
+
+    def clean_up(self):
+        if os.path.exists(self.temp_location / filename):
+            os.remove(self.temp_location / filename)
+        for path in self.temp_location.glob("probe-*.mkv"):
+            os.remove(path)
@@ -0,0 +1,137 @@
+import os
+import shutil
+import sys
+import threading
+from pathlib import Path
+
+# free space left on the temp disk, chunks are not started below it
+MIN_FREE_MB = 1024
+# chunk size assumed before the first chunk finished, bytes per second of video
+DEFAULT_RATE = 1 << 20
+# a chunk may come out bigger than the average so far
+SIZE_MARGIN = 2.0
+# staged chunks are assembled early once they fill this share of the budget
+FLUSH_AT = 0.5
+check_interval = 5.0
+# with no other chunk of the job running only other jobs can free space, the chunk fails after this long
+max_space_wait = 300.0
+
+
+class TempStorage:
+    # puts chunks in RAM while the staging budget lasts and on disk after, keeps a reserve free on the disk
+
+    def __init__(self, temp_location, staging=None, staging_mb=0, min_free_mb=MIN_FREE_MB):
+        self.temp_location = Path(temp_location)
+        # one folder per temp folder, several jobs can stage next to each other
+        self.staging = Path(staging) / self.temp_location.resolve().name if staging and staging_mb > 0 else None
+        self.staging_budget = staging_mb * (1 << 20)
+        self.min_free = min_free_mb * (1 << 20)
+        self.lock = threading.Lock()
+        # estimated size of every chunk still being written, by path
+        self.reserved = {}
+        self.bytes = 0
+        self.seconds = 0.0
+        if self.staging is not None:
+            os.makedirs(self.staging, exist_ok=True)
+
+    def estimate(self, length):
+        rate = self.bytes / self.seconds if self.seconds else DEFAULT_RATE
+        return int(length * rate * SIZE_MARGIN)
+
+    def path(self, name):
+        # where a finished chunk is, parts and everything else stay in the temp folder
+        if self.staging is not None and os.path.exists(self.staging / name):
+            return self.staging / name
+        return self.temp_location / name
+
+    def exists(self, name):
+        return os.path.exists(self.path(name))
+
+    def place(self, name, length, directory=None):
+        # new chunks go to RAM until the budget is used up, the reservation is dropped by release
+        with self.lock:
+            estimate = self.estimate(length)
+            if directory is None:
+                directory = self.staging if self.staging_room(estimate) else self.temp_location
+            path = directory / name
+            self.reserved[path] = estimate
+            return path
+
+    def release(self, path, length=None):
+        # with a length the chunk was finished and its size teaches the estimate
+        with self.lock:
+            self.reserved.pop(path, None)
+            if length and os.path.exists(path):
+                self.bytes += os.path.getsize(path)
+                self.seconds += length
+
+    def staged_bytes(self):
+        sizes = {}
+        with os.scandir(self.staging) as entries:
+            for entry in entries:
+                if entry.is_file():
+                    sizes[Path(entry.path)] = entry.stat().st_size
+        for path, estimate in self.reserved.items():
+            if path.parent == self.staging:
+                sizes[path] = max(sizes.get(path, 0), estimate)
+        return sum(sizes.values())
+
+    def staging_room(self, estimate):
+        if self.staging is None:
+            return False
+        try:
+            return self.staged_bytes() + estimate <= self.staging_budget and \
+                shutil.disk_usage(self.staging).free > estimate
+        except OSError:
+            return False
+
+    def disk_room(self, estimate):
+        pending = sum(size for path, size in self.reserved.items() if path.parent == self.temp_location)
+        return shutil.disk_usage(self.temp_location).free - pending - estimate >= self.min_free
+
+    def wait_for_space(self, length, stop_event, running):
+        # holds the chunk back until other chunks, other jobs or the assembler free some space, False to give up
+        # and once the job was stopped
+        warned = False
+        idle = 0.0
+        while not stop_event.is_set():
+            with self.lock:
+                estimate = self.estimate(length)
+                if self.staging_room(estimate) or self.disk_room(estimate):
+                    return True
+            if not warned:
+                print(f"Less than {self.min_free >> 20} MiB free for {self.temp_location}, "
+                      f"waiting for space.", file=sys.stderr)
+                warned = True
+            if running():
+                idle = 0.0
+            elif idle >= max_space_wait:
+                return False
+            else:
+                idle += check_interval
+            stop_event.wait(check_interval)
+        return False
+
+    def should_flush(self):
+        if self.staging is None:
+            return False
+        with self.lock:
+            return self.staged_bytes() >= self.staging_budget * FLUSH_AT
+
+    def remove_other(self, path):
+        # a chunk of the same name left on the other tier would be read instead of this one
+        if self.staging is None:
+            return
+        other = (self.temp_location if path.parent == self.staging else self.staging) / path.name
+        if os.path.exists(other):
+            os.remove(other)
+
+    def remove(self, name):
+        path = self.path(name)
+        if os.path.exists(path):
+            os.remove(path)
+
+    def clean_up(self):
+        if self.staging is None:
+            return
+        shutil.rmtree(self.staging, ignore_errors=True)
@@ -0,0 +1,259 @@
+import argparse
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+from pathlib import Path
+from time import perf_counter, time
+from EncodingProcess import EncodingProcess
+from SceneManager import SceneManager
+from CostModel import CostModel
+import video
+import fingerprint
+import cpu
+
+SIZE = "1280x720"
+RATE = 24
+# pattern length of the cuts source, every boundary is a hard cut
+CUT_LENGTH = 4
+INTRO_LENGTH = 8
+PATTERNS = ["testsrc2", "smptebars", "rgbtestsrc", "mandelbrot", "yuvtestsrc", "testsrc"]
+BENCHMARKS = ["detection", "crop", "start", "dispatch", "pipeline"]
+# metrics compared against the baseline, everything else is recorded for reference
+LOWER_IS_BETTER = {"seconds"}
+HIGHER_IS_BETTER = {"fps", "add_per_s", "dispatch_per_s"}
+
+
+def pattern(name, duration, size=SIZE, options=""):
+    return f"{name}={options}s={size}:r={RATE},trim=duration={duration},setpts=PTS-STARTPTS,format=yuv420p"
+
+
+def sine(duration):
+    return f"sine=frequency=440:sample_rate=48000:duration={duration}"
+
+
+def silence(duration):
+    return f"anullsrc=r=48000:cl=mono,atrim=duration={duration}"
+
+
+def source_graph(name, duration):
+    # one lavfi graph per source, [out0] is the video and [out1] the audio
+    if name == "testsrc":
+        return f"{pattern('testsrc2', duration)}[out0];{sine(duration)}[out1]"
+    if name == "mandelbrot":
+        return f"{pattern('mandelbrot', duration)}[out0];{sine(duration)}[out1]"
+    if name == "cuts":
+        count = max(duration // CUT_LENGTH, 1)
+        parts = [f"{pattern(PATTERNS[i % len(PATTERNS)], CUT_LENGTH)}[v{i}]" for i in range(count)]
+        labels = "".join(f"[v{i}]" for i in range(count))
+        return ";".join(parts) + f";{labels}concat=n={count}:v=1:a=0[out0];{sine(count * CUT_LENGTH)}[out1]"
+    if name == "letterbox":
+        return f"{pattern('testsrc2', duration, '1280x536')},pad=1280:720:0:92[out0];{sine(duration)}[out1]"
+    if name == "black_intro":
+        return (f"{pattern('color', INTRO_LENGTH, options='c=black:')}[black];"
+                f"{pattern('testsrc2', duration - INTRO_LENGTH)}[main];[black][main]concat=n=2:v=1:a=0[out0];{sine(duration)}[out1]")
+    if name == "silent_intro":
+        return (f"{pattern('testsrc2', duration)}[out0];{silence(INTRO_LENGTH)}[quiet];"
+                f"{sine(duration - INTRO_LENGTH)}[tone];[quiet][tone]concat=n=2:v=0:a=1[out1]")
+    raise ValueError(f"unknown source {name}")
+
+
+def generate(name, directory, duration):
+    # sources are bit-exact for a given ffmpeg build and kept between runs
+    path = directory / f"{name}-{duration}s.mkv"
+    if path.exists():
+        return str(path)
+    directory.mkdir(parents=True, exist_ok=True)
+    tmp = directory / f"{name}-{duration}s.tmp.mkv"
+    subprocess.run(
+        ["ffmpeg", "-y", "-nostdin", "-loglevel", "error", "-f", "lavfi", "-i", source_graph(name, duration),
+         "-c:v", "libx264", "-preset", "ultrafast", "-g", str(RATE * 2), "-pix_fmt", "yuv420p", "-c:a", "flac",
+         "-fflags", "+bitexact", "-flags:v", "+bitexact", "-flags:a", "+bitexact", tmp],
+        check=True
+    )
+    os.replace(tmp, path)
+    return str(path)
+
+
+def process_for(source, temp_location, workers=None, preset=4, destination=None, **options):
+    info = video.probe(source)
+    resolution = video.get_output_resolution(source, None, None, info)
+    layout = cpu.plan(resolution, workers)
+    return EncodingProcess(source, destination, temp_location, layout.workers, None, resolution, 0.0, info.duration,
+                           info.fps, info.hdr, layout=layout, preset=preset, **options)
+
+
+def bench_detection(source, **options):
+    with tempfile.TemporaryDirectory() as temp_location:
+        process = process_for(source, temp_location, **options)
+        scene_manager = process.create_scene_manager()
+        started = perf_counter()
+        process.scene_detection(scene_manager)
+        seconds = perf_counter() - started
+        scene_manager.close()
+    frames = process.length * process.source_fps
+    return {"seconds": seconds, "fps": frames / seconds, "scenes": len(scene_manager.scenes)}
+
+
+def bench_crop(source):
+    video.probe(source)
+    started = perf_counter()
+    crop = video.get_crop(source)
+    separate = perf_counter() - started
+    started = perf_counter()
+    combined, start = video.analyse(source, True, False)
+    seconds = perf_counter() - started
+    return {"seconds": seconds, "get_crop_seconds": separate, "crop": combined, "get_crop": crop}
+
+
+def bench_start(source):
+    video.probe(source)
+    started = perf_counter()
+    crop, start = video.analyse(source, False, True)
+    return {"seconds": perf_counter() - started, "start": start}
+
+
+def bench_dispatch(count):
+    # queue operations only, no encoder is started
+    rng = random.Random(0)
+    with tempfile.TemporaryDirectory() as temp_location:
+        scene_manager = SceneManager(Path(temp_location), 0.0, 0.0, cost_model=CostModel(RATE, (1920, 1080)))
+        timestamp = 0.0
+        started = perf_counter()
+        for i in range(count):
+            timestamp += rng.uniform(0.5, 5.0)
+            scene_manager.add_scene(timestamp, rng.random())
+        scene_manager.finish_last_scene(timestamp + 1.0, rng.random())
+        added = perf_counter() - started
+        started = perf_counter()
+        while True:
+            scene, index = scene_manager.request_scene()
+            if scene is None:
+                break
+            attempt = scene_manager.start_attempt(scene)
+            attempt.started -= scene.get_length() * (1.0 + (scene.complexity or 0.0))
+            scene_manager.attempt_finished(attempt, True)
+        dispatched = perf_counter() - started
+        scene_manager.close()
+    scenes = len(scene_manager.scenes)
+    return {"seconds": added + dispatched, "scenes": scenes,
+            "add_per_s": scenes / added, "dispatch_per_s": scenes / dispatched}
+
+
+def bench_pipeline(source, preset, workers=None):
+    with tempfile.TemporaryDirectory() as temp_location:
+        destination = Path(temp_location) / "out.mkv"
+        process = process_for(source, Path(temp_location) / "work", workers, preset, destination)
+        os.mkdir(process.temp_location)
+        started = perf_counter()
+        process.start()
+        seconds = perf_counter() - started
+        size = os.path.getsize(destination) if destination.exists() else 0
+    frames = process.length * process.source_fps
+    return {"seconds": seconds, "fps": frames / seconds, "workers": process.max_workers, "bytes": size}
+
+
+def run(args):
+    directory = args.dir or fingerprint.cache_dir() / "bench"
+    source = lambda name: generate(name, directory, args.duration)
+    jobs = []
+    if "detection" in args.only:
+        for name in ["testsrc", "mandelbrot", "cuts"]:
+            jobs.append((f"detection/{name}", lambda name=name: bench_detection(source(name))))
+        jobs.append(("detection/cuts-fast",
+                     lambda: bench_detection(source("cuts"), scd_width=480, scd_step=2)))
+    if "crop" in args.only:
+        jobs.append(("crop/letterbox", lambda: bench_crop(source("letterbox"))))
+    if "start" in args.only:
+        for name in ["black_intro", "silent_intro"]:
+            jobs.append((f"start/{name}", lambda name=name: bench_start(source(name))))
+    if "dispatch" in args.only:
+        jobs.append((f"dispatch/{args.scenes}", lambda: bench_dispatch(args.scenes)))
+    if "pipeline" in args.only:
+        jobs.append((f"pipeline/cuts-p{args.preset}", lambda: bench_pipeline(source("cuts"), args.preset, args.w)))
+    results = {}
+    for name, job in jobs:
+        # the fastest of the repeats, the others only add noise
+        runs = [job() for i in range(args.repeat)]
+        results[name] = min(runs, key=lambda r: r["seconds"])
+        print(f"{name}: " + ", ".join(f"{k}={format_value(v)}" for k, v in results[name].items()), file=sys.stderr)
+    return results
+
+
+def environment():
+    try:
+        commit = subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=Path(__file__).parent,
+                                         stderr=subprocess.DEVNULL, text=True).strip()
+    except (subprocess.CalledProcessError, FileNotFoundError):
+        commit = None
+    try:
+        ffmpeg = subprocess.check_output(["ffmpeg", "-version"], text=True).splitlines()[0]
+    except (subprocess.CalledProcessError, FileNotFoundError):
+        ffmpeg = None
+    return {"commit": commit, "time": time(), "python": platform.python_version(), "platform": platform.platform(),
+            "cpus": len(cpu.available_cpus()), "ffmpeg": ffmpeg}
+
+
+def compare(results, baseline, threshold):
+    # regressions beyond the threshold, as (name, metric, old, new)
+    regressions = []
+    for name, metrics in results.items():
+        old = baseline.get(name)
+        if old is None:
+            continue
+        for metric, value in metrics.items():
+            if metric not in old or not isinstance(value, (int, float)) or not old[metric]:
+                continue
+            change = value / old[metric] - 1.0
+            if metric in LOWER_IS_BETTER and change > threshold or \
+                    metric in HIGHER_IS_BETTER and change < -threshold:
+                regressions.append((name, metric, old[metric], value))
+    return regressions
+
+
+def format_value(value):
+    return f"{value:.3f}" if isinstance(value, float) else str(value)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks on generated sources, compared against a JSON baseline.")
+    parser.add_argument("--only", nargs="+", choices=BENCHMARKS, default=BENCHMARKS,
+                        help="Benchmarks to run. Default is all.")
+    parser.add_argument("--duration", type=int, default=60,
+                        help="Length of the generated sources in seconds. Default is 60.", metavar="SEC")
+    parser.add_argument("--scenes", type=int, default=10000,
+                        help="Synthetic scenes for the dispatch benchmark. Default is 10000.", metavar="N")
+    parser.add_argument("--preset", type=int, default=12,
+                        help="SVT-AV1 preset of the pipeline run. Default is 12.", metavar="N")
+    parser.add_argument("-w", type=int, help="Workers of the pipeline run. Defaults to fitting the CPU.", metavar="N")
+    parser.add_argument("--repeat", type=int, default=1,
+                        help="Run every benchmark N times and keep the fastest.", metavar="N")
+    parser.add_argument("--dir", type=Path, help="Folder for the generated sources.", metavar="DIR")
+    parser.add_argument("--output", type=Path, default=Path("benchmark.json"),
+                        help="Write the results to FILE. Default is benchmark.json.", metavar="FILE")
+    parser.add_argument("--baseline", type=Path, help="Compare against an earlier output.", metavar="FILE")
+    parser.add_argument("--threshold", type=float, default=0.1,
+                        help="Relative change counted as a regression. Default is 0.1.", metavar="T")
+    args = parser.parse_args()
+    args.repeat = max(args.repeat, 1)
+
+    results = run(args)
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump({"environment": environment(), "results": results}, f, indent=4)
+
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline["results"], args.threshold)
+        for name, metric, old, new in regressions:
+            print(f"Regression in {name} {metric}: {format_value(old)} -> {format_value(new)}")
+        if regressions:
+            sys.exit(1)
+        print(f"No regressions against {baseline['environment'].get('commit') or args.baseline}.")
+
+
+if __name__ == '__main__':
+    main()
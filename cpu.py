@@ -0,0 +1,99 @@
+from pathlib import Path
+import os
+import re
+
+
+class Layout:
+
+    def __init__(self, core_sets, threads, nodes):
+        self.core_sets = core_sets
+        self.threads = threads
+        self.nodes = nodes
+        self.pinned = False
+
+    @property
+    def workers(self):
+        return len(self.core_sets)
+
+    def pin(self, process, slot):
+        # right after Popen, a preexec_fn can deadlock with other threads. The encoder starts its own threads
+        # later and they inherit the mask
+        if not self.pinned or slot is None or not hasattr(os, "sched_setaffinity"):
+            return
+        try:
+            os.sched_setaffinity(process.pid, self.core_sets[slot % len(self.core_sets)])
+        except OSError:
+            # already exited
+            pass
+
+    def describe(self):
+        pinned = " pinned" if self.pinned else ""
+        return f"{self.workers}x{self.threads}t {self.nodes} node{'s' if self.nodes != 1 else ''}{pinned}"
+
+
+def available_cpus():
+    if hasattr(os, "sched_getaffinity"):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count() or 1))
+
+
+def parse_cpulist(text):
+    cpus = []
+    for part in text.strip().split(","):
+        if not part:
+            continue
+        if "-" in part:
+            first, last = map(int, part.split("-"))
+            cpus.extend(range(first, last + 1))
+        else:
+            cpus.append(int(part))
+    return cpus
+
+
+def numa_nodes(cpus):
+    allowed = set(cpus)
+    nodes = []
+    node_root = Path("/sys/devices/system/node")
+    paths = sorted(node_root.glob("node[0-9]*"), key=lambda p: int(re.sub(r"\D", "", p.name)))
+    for path in paths:
+        try:
+            node_cpus = [c for c in parse_cpulist((path / "cpulist").read_text()) if c in allowed]
+        except (OSError, ValueError):
+            continue
+        if node_cpus:
+            nodes.append(node_cpus)
+    return nodes or [cpus]
+
+
+def threads_per_encoder(resolution):
+    # SVT-AV1 stops scaling well past a few threads per encoder at low resolutions
+    pixels = resolution[0] * resolution[1]
+    if pixels <= 1280 * 720:
+        return 2
+    if pixels <= 1920 * 1080:
+        return 4
+    if pixels <= 2560 * 1440:
+        return 6
+    return 8
+
+
+def plan(resolution, workers=None):
+    cpus = available_cpus()
+    nodes = numa_nodes(cpus)
+    if workers is None:
+        threads = min(threads_per_encoder(resolution), len(cpus))
+        workers = max(len(cpus) // threads, 1)
+    else:
+        threads = max(len(cpus) // workers, 1)
+    # hand out slots node by node so an encoder never spans two nodes
+    core_sets = []
+    slots_left = workers
+    for i, node in enumerate(nodes):
+        node_slots = round(workers * len(node) / len(cpus)) if i < len(nodes) - 1 else slots_left
+        node_slots = min(node_slots, slots_left)
+        for slot in range(node_slots):
+            start = (slot * threads) % len(node)
+            cores = {node[(start + k) % len(node)] for k in range(min(threads, len(node)))}
+            core_sets.append(cores)
+        slots_left -= node_slots
+    return Layout(core_sets, threads, len(nodes))
\ No newline at end of file
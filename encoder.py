@@ -0,0 +1,72 @@
+import re
+
+# an agent only builds commands from these, a lease comes off the network
+CROP_PATTERN = re.compile(r"crop=\d+:\d+:\d+:\d+")
+PRESETS = range(-1, 14)
+CRFS = range(0, 64)
+MAX_THREADS = 1024
+
+
+def params(preset, threads, crf=None):
+    return ["-c:v", "libsvtav1", "-preset", str(preset), "-svtav1-params", f"lp={threads}"] + \
+        (["-crf", str(crf)] if crf is not None else []) + ["-pix_fmt", "yuv420p10le"]
+
+
+def command(settings, source, output):
+    # one chunk, trimmed to exact frames when the settings carry a trim and cut by timestamps otherwise
+    x, y = settings["resolution"]
+    if settings["trim"] is not None:
+        start, end = settings["trim"]
+        seek = ["-noaccurate_seek", "-ss", str(settings["start"])]
+        filters = [f"trim=start={start}:end={end}", "setpts=PTS-STARTPTS"]
+        limit = ["-frames:v", str(settings["frames"])]
+    else:
+        seek = ["-ss", str(settings["start"]), "-to", str(settings["end"])]
+        filters = []
+        limit = []
+    if settings["crop"]:
+        filters.append(settings["crop"])
+    filters.append(f"scale={x}:{y}")
+    filter_complex = "[0:v:0]" + ",".join(filters) + "[v]"
+    return ["ffmpeg", "-y"] + seek + ["-i", source, "-nostdin",
+            "-loglevel", "fatal", "-progress", "pipe:1", "-nostats",
+            "-filter_complex", filter_complex, "-an", "-map", "[v]"] + limit + \
+        params(settings["preset"], settings["threads"], settings["crf"]) + [output]
+
+
+def validate(settings):
+    # raises ValueError for anything but plain numbers and a known crop
+    try:
+        if not is_number(settings["start"]) or settings["start"] < 0:
+            raise ValueError("bad start")
+        if settings["trim"] is None:
+            if not is_number(settings["end"]) or settings["end"] < settings["start"]:
+                raise ValueError("bad end")
+        else:
+            start, end = settings["trim"]
+            if not is_number(start) or not is_number(end) or start > end:
+                raise ValueError("bad trim")
+            if not is_integer(settings["frames"]) or settings["frames"] < 0:
+                raise ValueError("bad frame count")
+        x, y = settings["resolution"]
+        if not is_integer(x) or not is_integer(y) or x <= 0 or y <= 0:
+            raise ValueError("bad resolution")
+        if settings["crop"] is not None and not (isinstance(settings["crop"], str)
+                                                 and CROP_PATTERN.fullmatch(settings["crop"])):
+            raise ValueError("bad crop")
+        if not is_integer(settings["preset"]) or settings["preset"] not in PRESETS:
+            raise ValueError("bad preset")
+        if not is_integer(settings["threads"]) or not 0 < settings["threads"] <= MAX_THREADS:
+            raise ValueError("bad threads")
+        if settings["crf"] is not None and (not is_integer(settings["crf"]) or settings["crf"] not in CRFS):
+            raise ValueError("bad crf")
+    except (KeyError, TypeError) as e:
+        raise ValueError(f"incomplete settings: {e}")
+
+
+def is_integer(value):
+    return isinstance(value, int) and not isinstance(value, bool)
+
+
+def is_number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
@@ -0,0 +1,83 @@
+from pathlib import Path
+import hashlib
+import json
+import mmap
+import os
+
+SAMPLE_SIZE = 1024 * 1024
+STRIDE_BLOCKS = 64
+STRIDE_SIZE = 64 * 1024
+BUFFER_SIZE = 8 * 1024 * 1024
+
+
+def cache_dir():
+    base = os.environ.get("XDG_CACHE_HOME") or Path.home() / ".cache"
+    return Path(base) / "chunked-encoding"
+
+
+def get_fingerprint(path, mode="sampled"):
+    # digests are reused while device, inode, size and mtime are unchanged
+    stat = os.stat(path)
+    key = f"{mode}:{stat.st_dev}:{stat.st_ino}:{stat.st_size}:{stat.st_mtime_ns}"
+    cache_path = cache_dir() / "fingerprints.json"
+    cache = load_cache(cache_path)
+    if key in cache:
+        return bytes.fromhex(cache[key])
+    if mode == "full":
+        digest = full_hash(path, stat.st_size)
+    else:
+        digest = sampled_hash(path, stat.st_size)
+    cache[key] = digest.hex()
+    save_cache(cache_path, cache)
+    return digest
+
+
+def sampled_hash(path, size):
+    sha_256 = hashlib.sha256()
+    sha_256.update(str(size).encode("utf-8"))
+    with open(path, "rb") as f:
+        if size <= 2 * SAMPLE_SIZE + STRIDE_BLOCKS * STRIDE_SIZE:
+            sha_256.update(f.read())
+            return sha_256.digest()
+        sha_256.update(f.read(SAMPLE_SIZE))
+        stride = (size - 2 * SAMPLE_SIZE) // (STRIDE_BLOCKS + 1)
+        for i in range(1, STRIDE_BLOCKS + 1):
+            f.seek(SAMPLE_SIZE + i * stride)
+            sha_256.update(f.read(STRIDE_SIZE))
+        f.seek(size - SAMPLE_SIZE)
+        sha_256.update(f.read(SAMPLE_SIZE))
+    return sha_256.digest()
+
+
+def full_hash(path, size):
+    sha_256 = hashlib.sha256()
+    with open(path, "rb") as f:
+        if size == 0:
+            return sha_256.digest()
+        try:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+                sha_256.update(m)
+        except (OSError, ValueError):
+            f.seek(0)
+            for byte_block in iter(lambda: f.read(BUFFER_SIZE), b""):
+                sha_256.update(byte_block)
+    return sha_256.digest()
+
+
+def load_cache(cache_path):
+    try:
+        with open(cache_path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, json.JSONDecodeError):
+        return {}
+
+
+def save_cache(cache_path, cache):
+    try:
+        cache_path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = cache_path.with_suffix(f".{os.getpid()}.tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(cache, f)
+        os.replace(tmp, cache_path)
+    except OSError:
+        pass
@@ -0,0 +1,99 @@
+import struct
+
+FILE_HEADER = struct.Struct("<4sHH4sHHIII4x")
+FRAME_HEADER = struct.Struct("<IQ")
+OBU_SEQUENCE_HEADER = 1
+
+
+def read_header(f):
+    data = f.read(FILE_HEADER.size)
+    if len(data) < FILE_HEADER.size:
+        raise ValueError("truncated IVF header")
+    signature, version, header_size, fourcc, width, height, rate, scale, count = FILE_HEADER.unpack(data)
+    if signature != b"DKIF" or fourcc != b"AV01":
+        raise ValueError("not an AV1 IVF file")
+    f.seek(header_size)
+    return {"width": width, "height": height, "rate": rate, "scale": scale, "header_size": header_size}
+
+
+def frames(f):
+    while True:
+        data = f.read(FRAME_HEADER.size)
+        if not data:
+            return
+        if len(data) < FRAME_HEADER.size:
+            raise ValueError("truncated IVF frame header")
+        size, pts = FRAME_HEADER.unpack(data)
+        payload = f.read(size)
+        if len(payload) < size:
+            raise ValueError("truncated IVF frame")
+        yield pts, payload
+
+
+def read_leb128(data, offset):
+    value = 0
+    for i in range(8):
+        byte = data[offset + i]
+        value |= (byte & 0x7f) << (i * 7)
+        if not byte & 0x80:
+            return value, offset + i + 1
+    raise ValueError("invalid leb128")
+
+
+def obu_types(payload):
+    offset = 0
+    while offset < len(payload):
+        header = payload[offset]
+        obu_type = (header >> 3) & 0x0f
+        offset += 2 if header & 0x04 else 1
+        if not header & 0x02:
+            yield obu_type
+            return
+        size, offset = read_leb128(payload, offset)
+        yield obu_type
+        offset += size
+
+
+def check(path):
+    # whole frames only, and the chunk has to open with a sequence header
+    try:
+        with open(path, "rb") as f:
+            read_header(f)
+            count = 0
+            for pts, payload in frames(f):
+                if count == 0 and OBU_SEQUENCE_HEADER not in obu_types(payload):
+                    return False
+                count += 1
+            return count > 0
+    except (OSError, ValueError, IndexError):
+        return False
+
+
+def concat(paths, out):
+    # byte-level join, only the first file header is kept and timestamps run on
+    header = None
+    offset = 0
+    frame_count = 0
+    for path in paths:
+        with open(path, "rb") as f:
+            chunk_header = read_header(f)
+            if header is None:
+                header = chunk_header
+                out.write(FILE_HEADER.pack(b"DKIF", 0, FILE_HEADER.size, b"AV01", header["width"],
+                                           header["height"], header["rate"], header["scale"], 0))
+            elif (chunk_header["rate"], chunk_header["scale"]) != (header["rate"], header["scale"]):
+                raise ValueError(f"{path} has a different timebase")
+            first = last = None
+            step = 1
+            for pts, payload in frames(f):
+                if first is None:
+                    first = pts
+                elif last is not None and pts > last:
+                    step = pts - last
+                last = pts
+                out.write(FRAME_HEADER.pack(len(payload), pts - first + offset))
+                out.write(payload)
+                frame_count += 1
+            if last is not None:
+                offset += last - first + step
+    return frame_count
@@ -1,26 +1,42 @@
 import os
 import sys
-from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 import hashlib
 import base64
 import argparse
+import json
 import re
+import datetime
 import shutil
 from EncodingProcess import EncodingProcess
+from AnalysisCache import AnalysisCache
+from BatchProcess import BatchProcess
+from Agent import Agent, TOKEN_ENV
 
 import time
 
 import video
+import fingerprint
+import cpu
+import encoder
 
 
 def main():
     # --- Parse args ---
     parser = argparse.ArgumentParser(description='test description #1')
     # input/output
-    parser.add_argument("-i", help="Path to the input file.", type=valid_path, required=True, metavar="FILE")
-    parser.add_argument("-o", help="Path to the output file.", type=Path, required=True, metavar="FILE")
-    parser.add_argument("-w", type=int, help="Set the number of workers. Default is 4.", metavar="N")
+    parser.add_argument("-i", help="Path to the input file. Repeat for a batch.", type=valid_path,
+                        action="append", metavar="FILE")
+    parser.add_argument("-o", help="Path to the output file, or the output folder for a batch.", type=Path,
+                        metavar="FILE")
+    parser.add_argument("--manifest", type=valid_path,
+                        help="JSON list of {\"input\", \"output\", \"priority\"} objects to encode as a batch.",
+                        metavar="FILE")
+    parser.add_argument("--lookahead", type=int, default=1,
+                        help="Number of batch files analysed ahead of the ones encoding. Default is 1.", metavar="N")
+    parser.add_argument("-w", type=workers_type,
+                        help="Set the number of workers, or 'auto' to fit workers and encoder threads to the CPU. "
+                             "Default is 1.", metavar="N")
     # autocrop, resolution limit
     parser.add_argument("--autocrop", action=argparse.BooleanOptionalAction, default=False,
                         help="Enable or disable automatic cropping.")
@@ -28,6 +44,87 @@ def main():
                         help="Automatically find the start of the video using audio and video analysis.")
     parser.add_argument("--res", type=resolution_type,
                         help="Set resolution limit (e.g. 1920x1080). Downscales to longest axis.", metavar="WxH")
+    parser.add_argument("--frameserver", action=argparse.BooleanOptionalAction, default=False,
+                        help="Decode, crop and scale the source once and pipe raw frames to the encoders.")
+    parser.add_argument("--buffer", type=int, default=1024,
+                        help="Frame server buffer size in MiB, split between the decoders. Default is 1024.", metavar="MB")
+    parser.add_argument("--scd-segments", type=int, default=1,
+                        help="Split scene detection into N keyframe-aligned segments analysed in parallel.", metavar="N")
+    parser.add_argument("--scd-width", type=int,
+                        help="Downscale to this width for scene detection.", metavar="W")
+    parser.add_argument("--scd-step", type=int, default=1,
+                        help="Only analyse every Nth frame for scene detection.", metavar="N")
+    parser.add_argument("--scd-threshold", type=float, default=0.25,
+                        help="Scene change score above which a cut is made. Default is 0.25.", metavar="T")
+    parser.add_argument("--min-scene", type=float, default=1.0,
+                        help="Minimum scene length in seconds. Default is 1.", metavar="SEC")
+    parser.add_argument("--max-scene", type=float,
+                        help="Maximum scene length in seconds.", metavar="SEC")
+    parser.add_argument("--fingerprint", choices=["sampled", "full"], default="sampled",
+                        help="Hash sampled blocks of the input or the whole file to key the temp folder.")
+    parser.add_argument("--temp-dir", type=valid_path,
+                        help="Folder the temp folder is created in. Default is the current folder.", metavar="DIR")
+    parser.add_argument("--stage", nargs="?", const="/dev/shm", type=valid_path,
+                        help="Write chunks to a RAM folder first, /dev/shm if no DIR is given.", metavar="DIR")
+    parser.add_argument("--stage-size", type=int, default=2048,
+                        help="RAM used for staged chunks in MiB, later chunks go to disk. Default is 2048.",
+                        metavar="MB")
+    parser.add_argument("--min-free", type=int, default=1024,
+                        help="Free space in MiB kept on the temp disk, chunks wait for it. Default is 1024.",
+                        metavar="MB")
+    parser.add_argument("--cache", action=argparse.BooleanOptionalAction, default=True,
+                        help="Reuse probe, crop, start and scene analysis from earlier runs of the same input.")
+    parser.add_argument("--cache-size", type=int, default=1024,
+                        help="Analysis cache size limit in MiB. Default is 1024.", metavar="MB")
+    parser.add_argument("--max-chunk", type=float,
+                        help="Split longer scenes into chunks of at most SEC seconds. "
+                             "Defaults to a limit based on the duration and worker count, 0 disables.", metavar="SEC")
+    parser.add_argument("--split", choices=["even", "keyframe"], default="even",
+                        help="Split long scenes evenly or at the nearest following keyframe.")
+    parser.add_argument("--speculate", action=argparse.BooleanOptionalAction, default=False,
+                        help="Let idle workers duplicate the slowest remaining chunks, first copy wins.")
+    parser.add_argument("--metrics", type=Path,
+                        help="Export metrics as JSON lines, or as a Prometheus textfile if FILE ends in .prom.",
+                        metavar="FILE")
+    parser.add_argument("--affinity", action=argparse.BooleanOptionalAction, default=False,
+                        help="Pin every encoder to its own set of cores within one NUMA node.")
+    parser.add_argument("--chunk-format", choices=["mp4", "ivf"], default="mp4",
+                        help="Write chunks as mp4, or as raw AV1 in IVF and join them byte by byte.")
+    parser.add_argument("--preset", type=int, default=4, choices=encoder.PRESETS,
+                        help="SVT-AV1 preset, higher is faster. Default is 4.", metavar="N")
+    parser.add_argument("--target-quality", type=float,
+                        help="Pick a CRF per chunk so that its score reaches Q, e.g. 93 for VMAF.", metavar="Q")
+    parser.add_argument("--target-metric", choices=["vmaf", "ssim", "psnr"], default="vmaf",
+                        help="Metric of the target quality probes. Default is vmaf.")
+    parser.add_argument("--probes", type=int, default=4,
+                        help="Probe encodes per search round. Default is 4.", metavar="N")
+    parser.add_argument("--probe-width", type=int, default=480,
+                        help="Width the probes are encoded and scored at. Default is 480.", metavar="W")
+    parser.add_argument("--probe-step", type=int, default=1,
+                        help="Only probe every Nth frame.", metavar="N")
+    parser.add_argument("--deadline", type=deadline_type,
+                        help="Finish by this time (HH:MM) or within this long (e.g. 90m, 2h), "
+                             "picking the slowest preset per chunk that keeps to it.", metavar="TIME")
+    parser.add_argument("--min-preset", type=int, default=2, choices=encoder.PRESETS,
+                        help="Slowest preset used with --deadline. Default is 2.", metavar="N")
+    parser.add_argument("--max-preset", type=int, default=12, choices=encoder.PRESETS,
+                        help="Fastest preset used with --deadline. Default is 12.", metavar="N")
+    parser.add_argument("--listen", type=address_type,
+                        help="Lease chunks to agents connecting to HOST:PORT, next to the local workers.",
+                        metavar="HOST:PORT")
+    parser.add_argument("--lease", type=float, default=60.0,
+                        help="Seconds an agent may stay silent before its chunk is requeued. Default is 60.",
+                        metavar="SEC")
+    parser.add_argument("--agents", type=int, default=0,
+                        help="Start N agents on this machine that connect to the coordinator.", metavar="N")
+    parser.add_argument("--agent", type=address_type,
+                        help="Run as an agent encoding chunks for the coordinator at HOST:PORT.", metavar="HOST:PORT")
+    parser.add_argument("--token", default=os.environ.get(TOKEN_ENV),
+                        help=f"Shared secret agents present to the coordinator, needed with --listen. "
+                             f"Defaults to ${TOKEN_ENV}.", metavar="SECRET")
+    parser.add_argument("--media", type=Path,
+                        help="Folder holding the sources on this agent, if mounted elsewhere than on the coordinator.",
+                        metavar="DIR")
     args = parser.parse_args()
 
     # --- double-check ffmpeg ---
@@ -35,44 +132,121 @@ def main():
     if not shutil.which("ffmpeg"):
         sys.exit("no ffmpeg version was found on this system.")
 
-    # --- determine crop, start, hdr, etc. ---
-    # Refactor soon!
-    with ThreadPoolExecutor() as executor:
-        future_crop = executor.submit(video.get_crop, args.i) if args.autocrop else None
-        future_start = executor.submit(video.get_video_start, args.i) if args.findstart else None
-        future_hdr = executor.submit(video.get_hdr, args.i)
-    crop = future_crop.result() if future_crop else None
-    start = future_start.result() if future_start else 0.0
-    hdr = future_hdr.result()
-    video_json = video.get_characteristics(args.i)
-    length = float(video_json["format"]["duration"])
-    fps = video_json["streams"][0]["r_frame_rate"]
-    if "/" in fps:
-        num, den = fps.split("/")
-        fps = float(num) / float(den)
+    if args.agent:
+        Agent(args.agent, get_layout(args, args.res or (1920, 1080)).workers, args.media, args.token).run()
+        return
+    if args.listen and not args.token:
+        parser.error("--listen needs --token, agents are only accepted with the same secret")
+    if args.agents and not args.listen:
+        args.listen = ("127.0.0.1", 0)
+
+    jobs = get_jobs(args, parser)
+    if args.listen and (len(jobs) > 1 or args.manifest):
+        parser.error("--listen and --agents need a single input")
+    if args.deadline and args.frameserver:
+        parser.error("--deadline cannot be combined with --frameserver")
+    if args.listen and args.frameserver:
+        parser.error("--listen and --agents cannot be combined with --frameserver")
+    if len(jobs) == 1 and not args.manifest:
+        source, destination, priority = jobs[0]
+        process = prepare(args, source, destination)
+        process.start()
     else:
-        fps = float(fps)
+        # one pool for the whole batch, sized for --res or 1080p when auto
+        layout = get_layout(args, args.res or (1920, 1080))
+        batch = BatchProcess(jobs, lambda source, destination: prepare(args, source, destination, layout),
+                             layout.workers, args.lookahead + 1)
+        batch.start()
+
+
+def get_jobs(args, parser):
+    jobs = []
+    if args.manifest:
+        with open(args.manifest, "r", encoding="utf-8") as f:
+            for item in json.load(f):
+                try:
+                    source = valid_path(item["input"])
+                except argparse.ArgumentTypeError as e:
+                    parser.error(str(e))
+                output = Path(item.get("output") or Path(args.o or ".") / (Path(source).stem + ".mp4"))
+                jobs.append((source, output, item.get("priority", 0)))
+    inputs = args.i or []
+    if len(inputs) == 1 and not args.manifest:
+        if args.o is None:
+            parser.error("-o is required")
+        return [(inputs[0], args.o, 0)]
+    for source in inputs:
+        jobs.append((source, Path(args.o or ".") / (Path(source).stem + ".mp4"), 0))
+    if not jobs:
+        parser.error("an input is required, use -i or --manifest")
+    # outputs are named after the input only, two inputs must not write the same file
+    sources = {}
+    for source, output, priority in jobs:
+        key = os.path.abspath(output)
+        if key in sources:
+            parser.error(f"{sources[key]} and {source} would both be written to {output}, "
+                         f"set the outputs in a --manifest")
+        sources[key] = source
+    return jobs
 
-    resolution = video.get_output_resolution(args.i, crop, args.res)
 
-    if args.w:
-        workers = max(args.w, 1)
+def get_layout(args, resolution):
+    if args.w == "auto":
+        layout = cpu.plan(resolution)
     else:
-        workers = 1
+        layout = cpu.plan(resolution, max(args.w, 1) if args.w else 1)
+    layout.pinned = args.affinity
+    return layout
 
-    temp_location = get_file_hash_b64(args.i, resolution, start)
-    if not Path(temp_location).exists():
+
+def prepare(args, source, destination, layout=None):
+    # --- determine crop, start, hdr, etc. ---
+    source_key = fingerprint.get_fingerprint(source, args.fingerprint).hex()
+    cache = AnalysisCache(limit_mb=args.cache_size) if args.cache else None
+    entry = cache.get_analysis(source_key) if cache else {}
+    if "probe" in entry:
+        info = video.MediaInfo(entry["probe"])
+    else:
+        info = video.probe(source)
+    need_crop = args.autocrop and "crop" not in entry
+    need_start = args.findstart and "start" not in entry
+    crop, start = video.analyse(source, need_crop, need_start, info)
+    updated = dict(entry, probe=info.data)
+    if need_crop:
+        updated["crop"] = crop
+    if need_start:
+        updated["start"] = start
+    if cache and updated != entry:
+        cache.put_analysis(source_key, updated)
+    crop = updated["crop"] if args.autocrop else None
+    start = updated["start"] if args.findstart else 0.0
+    hdr = info.hdr
+    length = info.duration
+    fps = info.fps
+
+    resolution = video.get_output_resolution(source, crop, args.res, info)
+
+    if layout is None:
+        layout = get_layout(args, resolution)
+    workers = layout.workers
+
+    temp_location = Path(args.temp_dir or ".") / get_file_hash_b64(source, resolution, start, args.fingerprint)
+    if not temp_location.exists():
         os.mkdir(temp_location)
 
-    process = EncodingProcess(args.i, args.o, temp_location, workers, crop, resolution, start, length, fps, hdr)
-    process.start()
+    return EncodingProcess(source, destination, temp_location, workers, crop, resolution, start, length, fps, hdr,
+                           args.frameserver, args.buffer, args.scd_segments, args.scd_width, args.scd_step,
+                           args.scd_threshold, args.min_scene, args.max_scene, cache, source_key,
+                           args.max_chunk, args.split, args.speculate,
+                           args.metrics, layout, args.chunk_format, args.listen, args.lease, args.agents,
+                           args.preset, args.target_quality, args.target_metric, args.probes, args.probe_width,
+                           args.probe_step, args.deadline, args.min_preset, args.max_preset, args.stage,
+                           args.stage_size, args.min_free, args.token)
 
 
-def get_file_hash_b64(path, resolution, start):
+def get_file_hash_b64(path, resolution, start, mode="sampled"):
     sha_256 = hashlib.sha256()
-    with open(path, "rb") as f:
-        for byte_block in iter(lambda: f.read(4096), b""):
-            sha_256.update(byte_block)
+    sha_256.update(fingerprint.get_fingerprint(path, mode))
     sha_256.update(str(resolution).encode("utf-8"))
     sha_256.update(str(start).encode('utf-8'))
     digest = sha_256.digest()
@@ -84,6 +258,34 @@ def valid_path(path_str):
         raise argparse.ArgumentTypeError(f"Path does not exist: {path_str}")
     return p.as_posix()
 
+def workers_type(string):
+    if string == "auto":
+        return string
+    try:
+        return int(string)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"Workers '{string}' must be a number or 'auto'")
+
+def address_type(string):
+    host, _, port = string.rpartition(":")
+    if not host or not port.isdigit():
+        raise argparse.ArgumentTypeError(f"Address '{string}' must be in HOST:PORT format (e.g., 0.0.0.0:9000)")
+    return host, int(port)
+
+def deadline_type(string):
+    # a clock time is the next time it comes around, anything else is a duration from now
+    match = re.match(r"^(\d{1,2}):(\d{2})$", string)
+    if match:
+        now = datetime.datetime.now()
+        deadline = now.replace(hour=int(match.group(1)), minute=int(match.group(2)), second=0, microsecond=0)
+        if deadline <= now:
+            deadline += datetime.timedelta(days=1)
+        return deadline.timestamp()
+    match = re.match(r"^(\d+(?:\.\d+)?)([smh]?)$", string)
+    if not match:
+        raise argparse.ArgumentTypeError(f"Deadline '{string}' must be HH:MM or a duration like 90m or 2h")
+    return time.time() + float(match.group(1)) * {"": 1, "s": 1, "m": 60, "h": 3600}[match.group(2)]
+
 def resolution_type(string):
     if not re.match(r"^\d+x\d+$", string):
         raise argparse.ArgumentTypeError(f"Resolution '{string}' must be in WIDTHxHEIGHT format (e.g., 1920x1080)")
@@ -0,0 +1,38 @@
+import os
+import struct
+
+BOX_HEADER = struct.Struct(">I4s")
+LARGE_SIZE = struct.Struct(">Q")
+REQUIRED = {b"ftyp", b"moov", b"mdat"}
+
+
+def boxes(f, size):
+    offset = 0
+    while offset < size:
+        f.seek(offset)
+        data = f.read(BOX_HEADER.size)
+        if len(data) < BOX_HEADER.size:
+            raise ValueError("truncated box header")
+        length, kind = BOX_HEADER.unpack(data)
+        if length == 1:
+            data = f.read(LARGE_SIZE.size)
+            if len(data) < LARGE_SIZE.size:
+                raise ValueError("truncated box size")
+            length = LARGE_SIZE.unpack(data)[0]
+        elif length == 0:
+            # the last box runs to the end of the file
+            length = size - offset
+        if length < BOX_HEADER.size or offset + length > size:
+            raise ValueError("box runs past the end of the file")
+        yield kind
+        offset += length
+
+
+def check(path):
+    # the top level boxes have to fill the file exactly, with the header and the media data present
+    try:
+        size = os.path.getsize(path)
+        with open(path, "rb") as f:
+            return REQUIRED <= set(boxes(f, size))
+    except (OSError, ValueError):
+        return False
@@ -0,0 +1,5 @@
+import sys
+from pathlib import Path
+
+# the modules sit flat in the repository root, a bare pytest does not put it on the path
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
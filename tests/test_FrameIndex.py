@@ -0,0 +1,34 @@
+from array import array
+
+from FrameIndex import FrameIndex
+
+
+def index(tmp_path, pts, keyframes):
+    frame_index = FrameIndex(tmp_path)
+    frame_index.pts = array("d", pts)
+    frame_index.keyframes = array("I", keyframes)
+    return frame_index
+
+
+def test_frame_at_picks_the_nearest_boundary(tmp_path):
+    frame_index = index(tmp_path, [0.0, 0.04, 0.08, 0.12], [0, 2])
+    assert frame_index.frame_at(0.0) == 0
+    assert frame_index.frame_at(0.05) == 1
+    assert frame_index.frame_at(0.07) == 2
+    assert frame_index.frame_at(0.15) == 4
+    assert frame_index.frame_at(10.0) == 4
+
+
+def test_boundary_is_midway_between_frames(tmp_path):
+    frame_index = index(tmp_path, [0.0, 0.04, 0.10, 0.12], [0])
+    assert frame_index.boundary(0) == -0.02
+    assert frame_index.boundary(2) == 0.07
+    assert abs(frame_index.boundary(4) - 0.13) < 1e-9
+
+
+def test_save_and_load(tmp_path):
+    index(tmp_path, [0.0, 0.04, 0.08], [0, 2]).save()
+    loaded = FrameIndex(tmp_path)
+    assert loaded.load()
+    assert list(loaded.pts) == [0.0, 0.04, 0.08] and list(loaded.keyframes) == [0, 2]
+    assert loaded.keyframe_before(1) == 0 and loaded.keyframe_after(1) == 2 and loaded.keyframe_after(3) is None
@@ -0,0 +1,37 @@
+from SceneIndex import CutFinder
+
+FPS = 24
+
+
+def run(finder, scores):
+    cuts = []
+    for i, score in enumerate(scores):
+        cuts += finder.feed((i + 0.5) / FPS, score)
+    return cuts
+
+
+def test_cuts_above_threshold():
+    scores = [0.9 if i in (30, 100) else 0.0 for i in range(FPS * 12)]
+    cuts = run(CutFinder(0, 0.25, 1.0), scores)
+    assert cuts == [30.5 / FPS, 100.5 / FPS]
+
+
+def test_min_length_skips_close_changes():
+    scores = [0.9 if i in (30, 40) else 0.0 for i in range(FPS * 4)]
+    assert run(CutFinder(0, 0.25, 1.0), scores) == [30.5 / FPS]
+
+
+def test_max_length_on_flat_scores_cuts_at_max_length():
+    scores = [0.9 if i in (30, 100) else 0.0 for i in range(FPS * 12)]
+    cuts = run(CutFinder(0, 0.25, 1.0, 5.0), scores)
+    assert cuts[:2] == [30.5 / FPS, 100.5 / FPS]
+    lengths = [b - a for a, b in zip(cuts, cuts[1:])]
+    assert all(length >= 5.0 for length in lengths[1:])
+    assert len(cuts) == 3
+
+
+def test_max_length_prefers_strongest_change():
+    scores = [0.0] * (FPS * 6)
+    scores[FPS * 3] = 0.2
+    cuts = run(CutFinder(0, 0.25, 1.0, 5.0), scores)
+    assert cuts == [(FPS * 3 + 0.5) / FPS]
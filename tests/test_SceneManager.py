@@ -0,0 +1,70 @@
+from SceneManager import SceneManager
+from TempStorage import TempStorage
+
+
+def manager(tmp_path, staging_mb=0):
+    storage = TempStorage(tmp_path / "temp", tmp_path / "shm", staging_mb)
+    (tmp_path / "temp").mkdir(exist_ok=True)
+    scene_manager = SceneManager(tmp_path / "temp", 0.0, min_length=0.0, storage=storage)
+    scene_manager.finish_last_scene(0.4)
+    scene, index = scene_manager.request_scene()
+    return scene_manager, scene
+
+
+def test_duplicate_stays_on_the_tier_of_the_original(tmp_path):
+    scene_manager, scene = manager(tmp_path, staging_mb=1)
+    original = scene_manager.start_attempt(scene)
+    duplicate = scene_manager.start_attempt(scene)
+    assert duplicate.path.parent == original.path.parent == scene_manager.storage.staging
+    original.path.write_bytes(b"partial")
+    duplicate.path.write_bytes(b"complete")
+    assert scene_manager.attempt_finished(duplicate, True)
+    assert not scene_manager.attempt_finished(original, False)
+    assert scene_manager.chunk_path(0).read_bytes() == b"complete"
+    assert not (tmp_path / "temp" / "0.mp4").exists()
+
+
+def test_winner_removes_the_chunk_on_the_other_tier(tmp_path):
+    scene_manager, scene = manager(tmp_path)
+    scene_manager.storage = TempStorage(tmp_path / "temp", tmp_path / "shm", 1)
+    (scene_manager.storage.staging / "0.mp4").write_bytes(b"stale")
+    attempt = scene_manager.start_attempt(scene)
+    attempt.path = tmp_path / "temp" / "0.mp4"
+    attempt.path.write_bytes(b"complete")
+    assert scene_manager.attempt_finished(attempt, True)
+    assert scene_manager.chunk_path(0).read_bytes() == b"complete"
+
+
+def test_no_attempt_after_stop(tmp_path):
+    scene_manager, scene = manager(tmp_path)
+    scene_manager.stop()
+    assert scene_manager.start_attempt(scene) is None
+
+
+def test_scene_at_time_only_takes_scenes_starting_there(tmp_path):
+    scene_manager = SceneManager(tmp_path, 0.0, min_length=0.0)
+    scene_manager.add_scene(2.0)
+    scene_manager.finish_last_scene(4.0)
+    straddling = scene_manager.request_scene_at_time(1.0)
+    assert straddling.index == 0 and not straddling.is_processing
+    taken = scene_manager.request_scene_at_time(2.0)
+    assert taken.index == 1 and taken.is_processing
+    assert scene_manager.request_scene_at_time(4.0) is None
+
+
+def test_journal_replay_resumes_scenes(tmp_path):
+    scene_manager = SceneManager(tmp_path, 0.0, min_length=0.0)
+    scene_manager.add_scene(2.0, 0.5)
+    scene_manager.add_scene(4.0)
+    scene_manager.finish_last_scene(6.0)
+    scene, index = scene_manager.request_scene()
+    scene_manager.scene_finished(scene)
+    scene_manager.close()
+    with open(tmp_path / "journal.jsonl", "a", encoding="utf-8") as f:
+        f.write('["finish", 2')
+
+    resumed = SceneManager(tmp_path, 0.0, min_length=0.0)
+    assert [(s.start, s.end) for s in resumed.scenes] == [(0.0, 2.0), (2.0, 4.0), (4.0, 6.0)]
+    assert resumed.scenes[0].complexity == 0.5
+    assert [s.done_processing for s in resumed.scenes] == [i == index for i in range(3)]
+    assert resumed.scd_finished and resumed.done_count == 1
@@ -0,0 +1,21 @@
+import subprocess
+import sys
+import threading
+import time
+
+from TargetQuality import TargetQuality
+
+
+def test_stop_kills_running_probes(tmp_path):
+    stop_event = threading.Event()
+    target_quality = TargetQuality("in.mkv", tmp_path, None, (1920, 1080), 95, stop_event=stop_event)
+
+    def stop():
+        stop_event.set()
+        target_quality.stop()
+
+    threading.Timer(0.2, stop).start()
+    started = time.time()
+    result = target_quality.run([sys.executable, "-c", "import time; time.sleep(30)"], stdout=subprocess.DEVNULL)
+    assert result is None and time.time() - started < 10
+    assert target_quality.run([sys.executable, "-c", "pass"]) is None
@@ -0,0 +1,22 @@
+import threading
+
+import TempStorage
+from TempStorage import TempStorage as Storage
+
+
+def full(monkeypatch):
+    monkeypatch.setattr(Storage, "disk_room", lambda self, estimate: False)
+    monkeypatch.setattr(TempStorage, "check_interval", 0.01)
+
+
+def test_wait_gives_up_with_nothing_running(tmp_path, monkeypatch):
+    full(monkeypatch)
+    monkeypatch.setattr(TempStorage, "max_space_wait", 0.05)
+    assert not Storage(tmp_path).wait_for_space(1.0, threading.Event(), lambda: 0)
+
+
+def test_wait_returns_false_once_stopped(tmp_path, monkeypatch):
+    full(monkeypatch)
+    stop_event = threading.Event()
+    threading.Timer(0.05, stop_event.set).start()
+    assert not Storage(tmp_path).wait_for_space(1.0, stop_event, lambda: 1)
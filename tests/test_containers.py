@@ -0,0 +1,58 @@
+import io
+
+import pytest
+
+import ivf
+import mp4
+
+SEQUENCE_HEADER = bytes([ivf.OBU_SEQUENCE_HEADER << 3 | 0x02, 1, 0])
+FRAME = bytes([6 << 3 | 0x02, 1, 0])
+
+
+def write_ivf(path, frames, rate=24, scale=1):
+    with open(path, "wb") as f:
+        f.write(ivf.FILE_HEADER.pack(b"DKIF", 0, ivf.FILE_HEADER.size, b"AV01", 16, 16, rate, scale, len(frames)))
+        for pts, payload in frames:
+            f.write(ivf.FRAME_HEADER.pack(len(payload), pts))
+            f.write(payload)
+
+
+def test_ivf_check(tmp_path):
+    write_ivf(tmp_path / "ok.ivf", [(0, SEQUENCE_HEADER + FRAME), (1, FRAME)])
+    assert ivf.check(tmp_path / "ok.ivf")
+    write_ivf(tmp_path / "no_header.ivf", [(0, FRAME)])
+    assert not ivf.check(tmp_path / "no_header.ivf")
+    data = (tmp_path / "ok.ivf").read_bytes()
+    (tmp_path / "truncated.ivf").write_bytes(data[:-1])
+    assert not ivf.check(tmp_path / "truncated.ivf")
+
+
+def test_ivf_concat_runs_timestamps_on(tmp_path):
+    write_ivf(tmp_path / "0.ivf", [(0, SEQUENCE_HEADER + FRAME), (1, FRAME)])
+    write_ivf(tmp_path / "1.ivf", [(5, SEQUENCE_HEADER + FRAME), (6, FRAME), (7, FRAME)])
+    out = io.BytesIO()
+    assert ivf.concat([tmp_path / "0.ivf", tmp_path / "1.ivf"], out) == 5
+    out.seek(0)
+    ivf.read_header(out)
+    assert [pts for pts, payload in ivf.frames(out)] == [0, 1, 2, 3, 4]
+
+
+def test_ivf_concat_rejects_another_timebase(tmp_path):
+    write_ivf(tmp_path / "0.ivf", [(0, SEQUENCE_HEADER + FRAME)])
+    write_ivf(tmp_path / "1.ivf", [(0, SEQUENCE_HEADER + FRAME)], rate=25)
+    with pytest.raises(ValueError):
+        ivf.concat([tmp_path / "0.ivf", tmp_path / "1.ivf"], io.BytesIO())
+
+
+def box(kind, payload=b""):
+    return mp4.BOX_HEADER.pack(mp4.BOX_HEADER.size + len(payload), kind) + payload
+
+
+def test_mp4_check(tmp_path):
+    path = tmp_path / "chunk.mp4"
+    path.write_bytes(box(b"ftyp", b"isom") + box(b"moov") + box(b"mdat", b"data"))
+    assert mp4.check(path)
+    path.write_bytes(box(b"ftyp", b"isom") + box(b"mdat", b"data"))
+    assert not mp4.check(path)
+    path.write_bytes((box(b"ftyp", b"isom") + box(b"moov") + box(b"mdat", b"data"))[:-1])
+    assert not mp4.check(path)
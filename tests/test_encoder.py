@@ -0,0 +1,45 @@
+import pytest
+import encoder
+
+SETTINGS = {"start": 10.0, "end": 20.0, "trim": None, "crop": "crop=1920:800:0:140", "resolution": [1920, 800],
+            "threads": 4, "preset": 6, "crf": 30, "frames": None}
+
+
+def test_command_by_timestamps():
+    args = encoder.command(SETTINGS, "file:in.mkv", "out.mp4")
+    assert args[0] == "ffmpeg" and args[-1] == "out.mp4"
+    assert args[args.index("-ss") + 1] == "10.0" and args[args.index("-to") + 1] == "20.0"
+    assert "[0:v:0]crop=1920:800:0:140,scale=1920:800[v]" in args
+
+
+def test_command_by_frames():
+    args = encoder.command(dict(SETTINGS, start=9.5, trim=[-0.04, 9.96], frames=240), "file:in.mkv", "out.mp4")
+    assert "-noaccurate_seek" in args and "-to" not in args
+    assert args[args.index("-frames:v") + 1] == "240"
+    assert args[args.index("-filter_complex") + 1].startswith("[0:v:0]trim=start=-0.04:end=9.96,")
+
+
+@pytest.mark.parametrize("change", [
+    {"crop": "crop=1:1:0:0,movie=/etc/passwd"},
+    {"preset": "4 -f tee"},
+    {"crf": 99},
+    {"threads": 0},
+    {"start": "0; rm"},
+    {"trim": [5, 2], "frames": 10},
+    {"trim": [0.0, 2.0], "frames": "10"},
+    {"resolution": [1920]},
+    {"preset": True},
+])
+def test_validate_refuses(change):
+    with pytest.raises(ValueError):
+        encoder.validate(dict(SETTINGS, **change))
+
+
+def test_validate_refuses_missing_keys():
+    with pytest.raises(ValueError):
+        encoder.validate({"start": 0.0})
+
+
+def test_validate_accepts():
+    encoder.validate(SETTINGS)
+    encoder.validate(dict(SETTINGS, trim=[-0.02, 0.98], frames=24, end=None, crop=None, crf=None))
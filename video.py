@@ -1,9 +1,98 @@
 from pathlib import Path
 import concurrent.futures
+import functools
 import subprocess
 import json
 import re
-import sys
+
+
+class MediaInfo:
+
+    def __init__(self, data):
+        self.data = data
+        video_stream = next(s for s in data["streams"] if s.get("codec_type") == "video")
+        self.duration = float(data["format"]["duration"])
+        self.width = int(video_stream["width"])
+        self.height = int(video_stream["height"])
+        self.fps = parse_rate(video_stream["r_frame_rate"])
+        self.hdr = video_stream.get("color_transfer") == "smpte2084"
+        self.has_audio = any(s.get("codec_type") == "audio" for s in data["streams"])
+        # ffmpeg seeks and timestamps its output relative to this
+        self.start_time = float(data["format"].get("start_time", 0.0))
+
+
+def parse_rate(rate):
+    if "/" in rate:
+        num, den = rate.split("/")
+        return float(num) / float(den)
+    return float(rate)
+
+
+@functools.lru_cache(maxsize=None)
+def probe(source):
+    cmd = ["ffprobe", "-v", "error", "-print_format", "json", "-show_format", "-show_streams", source]
+    return MediaInfo(json.loads(subprocess.check_output(cmd).decode('utf-8')))
+
+
+def analyse(source, autocrop, findstart, info=None):
+    # crop sampling and start detection share a single ffmpeg run
+    if not autocrop and not findstart:
+        return None, 0.0
+    info = info or probe(source)
+    inputs, graph, maps = [], [], []
+    if findstart:
+        inputs += ["-t", "15", "-i", source]
+        graph.append("[0:v]trim=duration=7,blackdetect=d=0.05:pic_th=0.999:pix_th=0.10[black]")
+        maps += ["-map", "[black]"]
+        if info.has_audio:
+            graph.append("[0:a]atrim=duration=15,silencedetect=n=-50dB:d=0.05[silence]")
+            maps += ["-map", "[silence]"]
+    if autocrop:
+        start_buffer, end_buffer = info.duration * 0.05, info.duration * 0.95
+        num_points, frames_per_point = 6, 8
+        interval = (end_buffer - start_buffer) / (num_points + 1)
+        first_input = 1 if findstart else 0
+        for i in range(1, num_points + 1):
+            index = first_input + i - 1
+            inputs += ["-ss", str(start_buffer + i * interval), "-skip_frame", "nokey", "-i", source]
+            graph.append(f"[{index}:v]cropdetect=64:2:0,trim=end_frame={frames_per_point}[crop{i}]")
+            maps += ["-map", f"[crop{i}]"]
+    cmd = ["ffmpeg", "-nostdin", "-hide_banner", "-nostats"] + inputs + [
+        "-filter_complex", ";".join(graph)] + maps + ["-f", "null", "-"]
+    try:
+        output = subprocess.run(cmd, stderr=subprocess.PIPE, text=True, errors="replace", check=True).stderr
+    except (subprocess.CalledProcessError, FileNotFoundError):
+        return (get_crop(source) if autocrop else None), (get_video_start(source) if findstart else 0.0)
+    crop = parse_crop(output) if autocrop else None
+    if autocrop and crop is None:
+        crop = get_crop_backup(source)
+    start = parse_start(output) if findstart else 0.0
+    return crop, start
+
+
+def parse_crop(output):
+    # last crop line of every cropdetect instance, largest area wins
+    candidates = {}
+    for match in re.finditer(r'\[(Parsed_cropdetect_\d+) @ [^]]+\].*?crop=(\d+):(\d+):(\d+):(\d+)', output):
+        candidates[match.group(1)] = tuple(map(int, match.group(2, 3, 4, 5)))
+    if not candidates:
+        return None
+    w, h, x, y = max(candidates.values(), key=lambda c: c[0] * c[1])
+    return f"crop={w}:{h}:{x}:{y}"
+
+
+def parse_start(output):
+    black_end = 0.0
+    silence_end = 0.0
+    black_match = re.search(r'black_start:([0-9.]+).*?black_end:([0-9.]+)', output)
+    if black_match and float(black_match.group(1)) < 0.1:
+        black_end = float(black_match.group(2))
+    silence_matches = re.finditer(r'silence_start: ([-0-9.]+).*?silence_end: ([-0-9.]+)', output, re.DOTALL)
+    for match in silence_matches:
+        if float(match.group(1)) < 0.1:
+            silence_end = float(match.group(2))
+            break
+    return min(black_end, silence_end)
 
 
 def get_crop_backup(source):
@@ -34,12 +123,7 @@ def get_crop_backup(source):
 
 def get_crop(source):
     try:
-        duration_cmd = [
-            "ffprobe", "-v", "error", "-show_entries", "format=duration",
-            "-of", "default=noprint_wrappers=1:nokey=1", source
-        ]
-        duration_res = subprocess.run(duration_cmd, capture_output=True, text=True, check=True)
-        total_duration = float(duration_res.stdout.strip())
+        total_duration = probe(source).duration
 
         start_buffer, end_buffer = total_duration * 0.05, total_duration * 0.95
         scan_duration = end_buffer - start_buffer
@@ -83,17 +167,14 @@ def get_crop(source):
     except Exception as e:
         return get_crop_backup(source)
 
-def get_output_resolution(source, crop, limit):
+def get_output_resolution(source, crop, limit, info=None):
     if crop:
         crop_with_space = crop.replace(':', ' ').replace('=', ' ')
         parts = crop_with_space.split()
         x, y = int(parts[1]), int(parts[2])
     else:
-        cmd = ["ffprobe", "-v", "error", "-print_format", "json", "-select_streams", "v:0", "-show_entries",
-                                  "stream=width,height", source]
-        output = json.loads(subprocess.check_output(cmd).decode('utf-8'))
-        x = int(output["streams"][0]["width"])
-        y = int(output["streams"][0]["height"])
+        info = info or probe(source)
+        x, y = info.width, info.height
 
     if limit:
         limit_x, limit_y = limit
@@ -107,13 +188,6 @@ def get_output_resolution(source, crop, limit):
             y = int(round(y * factor))
     return x, y
 
-def get_characteristics(source):
-    cmd = ["ffprobe", "-v", "error", "-print_format", "json", "-select_streams", "v:0",
-           "-show_entries","format=duration:stream=r_frame_rate", source]
-    output = json.loads(subprocess.check_output(cmd).decode('utf-8'))
-    return output
-
-
 def get_video_start(source):
     cmd = [
         "ffmpeg", "-i", source, "-nostdin", "-hide_banner", "-nostats",
@@ -126,40 +200,36 @@ def get_video_start(source):
 
     try:
         output = subprocess.run(cmd, stderr=subprocess.PIPE, text=True, check=True).stderr
-        black_end = 0.0
-        silence_end = 0.0
-
-        # Regex for Blackdetect
-        black_match = re.search(r'black_start:([0-9.]+).*?black_end:([0-9.]+)', output)
-        if black_match and float(black_match.group(1)) < 0.1:
-            black_end = float(black_match.group(2))
-
-        # Regex for Silencedetect
-        # Finding the first silence_end that corresponds to a start near 0
-        silence_matches = re.finditer(r'silence_start: ([-0-9.]+).*?silence_end: ([-0-9.]+)', output, re.DOTALL)
-        for match in silence_matches:
-            if float(match.group(1)) < 0.1:
-                silence_end = float(match.group(2))
-                break
-
-        result = min(black_end, silence_end)
-        return result
-
+        return parse_start(output)
     except Exception as e:
         return 0.0
 
 def get_hdr(source):
-    command = [
-        "ffprobe", "-v", "error", "-select_streams", "v:0",
-        "-show_entries", "stream=color_transfer",
-        "-of", "default=noprint_wrappers=1", source
-    ]
+    return probe(source).hdr
+
+
+def get_keyframe_after(source, timestamp):
+    cmd = ["ffprobe", "-v", "error", "-select_streams", "v:0", "-skip_frame", "nokey",
+           "-read_intervals", f"{timestamp}%+#2", "-show_entries", "frame=pts_time",
+           "-of", "csv=p=0", source]
     try:
-        result = subprocess.run(command, capture_output=True, text=True, check=True)
-        output = result.stdout.strip()
-        if re.search(r'color_transfer=smpte2084', output):
-            return True
-        else:
-            return False
-    except (subprocess.CalledProcessError, FileNotFoundError) as e:
-        print(f"Error running ffprobe to check eotf: {e}", file=sys.stderr)
\ No newline at end of file
+        output = subprocess.run(cmd, capture_output=True, text=True, check=True).stdout
+        for line in output.splitlines():
+            line = line.strip().strip(",")
+            if line and line != "N/A" and float(line) >= timestamp:
+                return float(line)
+        return None
+    except (subprocess.CalledProcessError, FileNotFoundError, ValueError):
+        return None
+
+
+def get_segments(source, start, end, count):
+    # keyframe-aligned [start, end) ranges for parallel analysis
+    boundaries = [start]
+    step = (end - start) / count
+    for i in range(1, count):
+        keyframe = get_keyframe_after(source, start + i * step)
+        if keyframe is not None and boundaries[-1] < keyframe < end:
+            boundaries.append(keyframe)
+    boundaries.append(end)
+    return list(zip(boundaries[:-1], boundaries[1:]))